@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SurvivalAnalysisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'survival_analysis'
+
+    def ready(self):
+        from . import receivers  # noqa: F401  (connects cache invalidation signals)
+        from . import checks  # noqa: F401  (registers the shared cache check)
@@ -0,0 +1,90 @@
+"""
+Async versions of the survival analysis views, for the ASGI entry point.
+
+ORM reads use the async ORM. Fitting and figure rendering run the same
+functions as the sync views, in the compute process pool (``compute.py``),
+and the results are cached under the same keys; concurrent requests for the
+same unchanged data share a single computation (``aget_or_compute``).
+Enabled in urls.py with ``SURVIVAL_ASYNC_VIEWS = True``.
+"""
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, StreamingHttpResponse
+from django.shortcuts import render
+
+from .models import PatientSurvival, SurvivalData
+from .cache import aget_or_compute
+from .compute import run_in_pool
+from .exports import aiter_csv, write_xlsx
+from .figures import plotly_js_url
+from .incremental import read_curve
+from .summary import asurvival_summary
+from .views import _render_overall_graph, _render_survival_context, _survival_curves
+
+# Context processors may query the database, so templates render in a thread
+arender = sync_to_async(render)
+
+
+async def _build_survival_context():
+    """Async version of ``views._build_survival_context``"""
+    patient_rows = [row async for row in PatientSurvival.objects.values_list('duration', 'event_occurred')]
+    has_survival_data = await SurvivalData.objects.aexists()
+    curves = await sync_to_async(_survival_curves)() if has_survival_data else {}
+    return await run_in_pool(_render_survival_context, patient_rows, has_survival_data, plotly_js_url(), curves)
+
+
+async def _overall_survival_graph():
+    """Async version of ``views._overall_survival_graph``"""
+    return await run_in_pool(_render_overall_graph, await sync_to_async(read_curve)())
+
+
+async def survival(request):
+    try:
+        context = await aget_or_compute('survival_context', _build_survival_context)
+    except Exception as e:
+        return await arender(request, 'survival_analysis/results.html', {
+            'has_data': False,
+            'message': f'Error generating analysis: {str(e)}'
+        })
+
+    return await arender(request, 'survival_analysis/results.html', context)
+
+
+async def predictive_analytics(request):
+    summary = await asurvival_summary()
+    overall = summary['overall']
+
+    if overall['total_cases']:
+        context = {
+            'has_data': True,
+            'overall_graph': await aget_or_compute(
+                'predictive_overall_graph', _overall_survival_graph
+            ),
+            'total_cases': overall['total_cases'],
+            'death_cases': overall['death_cases'],
+            'survival_rate': overall['survival_rate'],
+            'diagnoses': list(summary['by_diagnosis']),
+            'care_levels': list(summary['by_care_level']),
+            'diagnosis_summary': summary['by_diagnosis'],
+            'care_level_summary': summary['by_care_level'],
+        }
+    elif await SurvivalData.objects.aexists():
+        context = {'has_data': False, 'message': 'No valid survival data available for analysis.'}
+    else:
+        context = {'has_data': False, 'message': 'No survival data available.'}
+
+    return await arender(request, 'survival_data/results.html', context)
+
+
+async def export_survival_data(request):
+    """Export all survival data as .xlsx (default) or ?format=csv, streamed in chunks"""
+    if request.GET.get('format') == 'csv':
+        response = StreamingHttpResponse(aiter_csv(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="survival_data.csv"'
+        return response
+
+    return FileResponse(
+        await sync_to_async(write_xlsx)(),
+        as_attachment=True,
+        filename='survival_data.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
@@ -0,0 +1,189 @@
+"""
+Shared authorization lookups for the role decorators.
+
+``get_authorization(request)`` loads a user's role, group names and
+permission codenames once and answers every check from memory. The result
+is kept on the request, and between requests (and across the user's
+sessions) in a per-user cache entry, read together with the version stamps
+in one round trip. The entry is trusted only while its stamps still match
+the per-user and global stamps, which the receivers in ``signals.py`` bump
+whenever groups, permissions or role flags change. Nothing is written to
+the session, so a stale entry never marks the session modified.
+
+A stamp is a random token, replaced (not incremented) on every bump, so
+two concurrent bumps can never merge into one value that a snapshot loaded
+in between was stamped with, even on a backend without an atomic incr.
+
+A bump is only seen by every worker if they share the cache, so with a
+per-process backend (LocMemCache, the default without CACHES) nothing is
+reused between requests and the snapshot is loaded from the database each
+time.
+"""
+import uuid
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+GLOBAL_VERSION_KEY = 'authz:version'
+USER_VERSION_KEY = 'authz:version:{user_id}'
+SNAPSHOT_KEY = 'authz:snapshot:{user_id}'
+SNAPSHOT_TIMEOUT = 60 * 60 * 24
+
+
+def _shared_cache():
+    """Whether version bumps made in one worker process are visible to all"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _token():
+    return uuid.uuid4().hex
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        # A fresh token, so an evicted stamp never matches an old stored copy
+        cache.add(key, _token(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(key):
+    cache.set(key, _token(), None)
+
+
+def invalidate_user(user_id):
+    """Drop cached authorization for one user (groups, permissions or role changed)"""
+    _bump(USER_VERSION_KEY.format(user_id=user_id))
+
+
+def global_version():
+    """The global stamp, which every group or permission change replaces"""
+    return _version(GLOBAL_VERSION_KEY)
+
+
+def invalidate_all():
+    """Drop cached authorization for everyone (a group's permissions changed)"""
+    _bump(GLOBAL_VERSION_KEY)
+
+
+class Authorization:
+    """In-memory snapshot of what a user is allowed to do"""
+
+    def __init__(self, user_id=None, role=None, profile_role=None, groups=(), permissions=(),
+                 group_permissions=None, is_superuser=False, is_staff=False, is_active=False,
+                 version=None):
+        self.user_id = user_id
+        self.role = role
+        self.profile_role = profile_role
+        self.groups = list(groups)  # Ordered by pk, like user.groups.all()
+        self.permissions = frozenset(permissions)
+        self.group_permissions = group_permissions or {}
+        self.is_superuser = is_superuser
+        self.is_staff = is_staff
+        self.is_active = is_active
+        self.version = version
+        self._groups_lower = frozenset(name.lower() for name in self.groups)
+
+    @property
+    def is_authenticated(self):
+        return self.user_id is not None
+
+    @property
+    def primary_group(self):
+        """Name of the user's first group, or None"""
+        return self.groups[0] if self.groups else None
+
+    def in_group(self, *names):
+        return any(name in self.groups for name in names)
+
+    def in_group_iexact(self, *names):
+        return any(name.lower() in self._groups_lower for name in names)
+
+    def has_perm(self, perm):
+        """Same answer as ``user.has_perm`` with the ModelBackend"""
+        return self.is_active and (self.is_superuser or perm in self.permissions)
+
+    def to_dict(self):
+        """Plain, JSON-serializable form stored in the cache"""
+        return {
+            'user_id': self.user_id, 'role': self.role, 'profile_role': self.profile_role,
+            'groups': self.groups, 'permissions': sorted(self.permissions),
+            'group_permissions': self.group_permissions,
+            'is_superuser': self.is_superuser, 'is_staff': self.is_staff,
+            'is_active': self.is_active, 'version': self.version,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+ANONYMOUS = Authorization()
+
+
+def _load(user, version):
+    # A missing profile raises RelatedObjectDoesNotExist, an AttributeError
+    profile_role = getattr(getattr(user, 'userprofile', None), 'role', None)
+
+    # Groups and their permission codenames in one joined query
+    groups = []
+    group_permissions = {}
+    for name, codename in user.groups.order_by('pk').values_list('name', 'permissions__codename'):
+        if name not in group_permissions:
+            groups.append(name)
+            group_permissions[name] = []
+        if codename:
+            group_permissions[name].append(codename)
+
+    return Authorization(
+        user_id=user.pk,
+        role=getattr(user, 'role', None),
+        profile_role=profile_role,
+        groups=groups,
+        permissions=user.get_all_permissions(),
+        group_permissions=group_permissions,
+        is_superuser=user.is_superuser,
+        is_staff=user.is_staff,
+        is_active=user.is_active,
+        version=version,
+    )
+
+
+def _is_current(data, user_id, version):
+    return bool(data) and data.get('user_id') == user_id and data.get('version') == version
+
+
+def get_authorization(request):
+    """Return the request user's ``Authorization``, loading it at most once"""
+    authorization = getattr(request, '_authorization', None)
+    if authorization is not None:
+        return authorization
+
+    user = request.user
+    if not user.is_authenticated:
+        request._authorization = ANONYMOUS
+        return ANONYMOUS
+
+    if not _shared_cache():
+        # Another worker's revocation would never reach a stored copy
+        authorization = _load(user, None)
+        request._authorization = authorization
+        return authorization
+
+    user_version_key = USER_VERSION_KEY.format(user_id=user.pk)
+    snapshot_key = SNAPSHOT_KEY.format(user_id=user.pk)
+    found = cache.get_many([GLOBAL_VERSION_KEY, user_version_key, snapshot_key])
+    version = [
+        found.get(GLOBAL_VERSION_KEY) or _version(GLOBAL_VERSION_KEY),
+        found.get(user_version_key) or _version(user_version_key),
+    ]
+    data = found.get(snapshot_key)
+    if not _is_current(data, user.pk, version):
+        data = _load(user, version).to_dict()
+        cache.set(snapshot_key, data, SNAPSHOT_TIMEOUT)
+
+    authorization = Authorization.from_dict(data)
+    request._authorization = authorization
+    return authorization
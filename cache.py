@@ -0,0 +1,247 @@
+"""
+Cache layer for computed survival analysis results.
+
+Results are stored under keys that embed a data-version stamp. The stamp is
+bumped whenever ``SurvivalData`` or ``PatientSurvival`` rows change (see
+``receivers.py``), so stale entries are never read again and simply expire.
+It is a counter row in the database (``SurvivalDataVersion``), bumped with an
+atomic UPDATE, so concurrent commits never share a version. Results are only
+reused across workers that share the cache, so a shared backend is required
+(``CACHES`` in settings.py; the ``survival_analysis.W001`` check flags a
+per-process one).
+
+Computing a missing result is single-flight (``get_or_compute``): one caller
+builds it under a cache lock while the others are served the last result
+built for an older version. With no older result to serve, sync callers
+build it themselves rather than block a worker thread, and async callers
+wait for it.
+"""
+import asyncio
+import hashlib
+import re
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import SurvivalDataVersion
+
+KEY_PREFIX = 'survival_analysis'
+DATA_VERSION_ID = 1  # pk of the SurvivalDataVersion row
+RESULT_TIMEOUT = 60 * 60 * 24  # Stale versions fall out of the cache after a day
+
+# Single-flight lock for cache misses: held for at most LOCK_TIMEOUT seconds
+# (so a crashed worker cannot wedge a key), waited on by async callers for at
+# most LOCK_WAIT
+LOCK_TIMEOUT = 60 * 5
+LOCK_WAIT = 30
+LOCK_POLL_INTERVAL = 0.1
+
+# A lock is only released while it is certainly still ours: before its
+# timeout, less this margin for clock drift against the cache server
+LOCK_RELEASE_MARGIN = 5
+
+# Stored in place of a None result, so "nothing to show" is cached as well
+NONE_RESULT = f'{KEY_PREFIX}:none'
+
+# Characters every cache backend (memcached included) accepts in a key
+_SAFE_KEY = re.compile(r'^[A-Za-z0-9_.:-]{0,150}$')
+
+
+def _initial_version():
+    # Seed from the clock (in microseconds) so a recreated version row never
+    # restarts at a number that older cached results were stored under.
+    return time.time_ns() // 1000
+
+
+def _versions():
+    return SurvivalDataVersion.objects.filter(pk=DATA_VERSION_ID).values_list('value', flat=True)
+
+
+def get_data_version():
+    """Return the current survival data version stamp"""
+    version = _versions().first()
+    if version is None:
+        version = SurvivalDataVersion.objects.get_or_create(
+            pk=DATA_VERSION_ID, defaults={'value': _initial_version()}
+        )[0].value
+    return version
+
+
+def bump_data_version():
+    """Invalidate every cached result by moving to a new data version; returns it"""
+    get_data_version()  # Creates the row on first use
+    with transaction.atomic():
+        # The row stays locked until commit, so concurrent bumps queue up
+        # and each reads back its own increment
+        _versions().update(value=F('value') + 1)
+        return _versions().get()
+
+
+def reset_data_version():
+    """
+    Jump to a fresh clock-seeded data version, past every version handed out
+    inside a transaction that was then rolled back (which rolled the row back
+    too); results cached under those versions must never be read.
+    """
+    get_data_version()
+    _versions().update(value=Greatest(F('value') + 1, _initial_version()))
+
+
+def _key_suffix(parts):
+    suffix = ':'.join(str(part) for part in parts)
+    if not _SAFE_KEY.match(suffix):
+        # Free-text parts such as diagnosis names are hashed into a safe key
+        suffix = hashlib.md5(suffix.encode()).hexdigest()
+    return suffix
+
+
+def versioned_key(name, *parts, version=None):
+    """Build a cache key for ``name`` bound to a data version"""
+    if version is None:
+        version = get_data_version()
+    suffix = _key_suffix(parts)
+    key = f'{KEY_PREFIX}:{name}:v{version}'
+    return f'{key}:{suffix}' if suffix else key
+
+
+def stale_key(name, *parts):
+    """Key holding the last result computed for ``name``, whatever its data version"""
+    suffix = _key_suffix(parts)
+    key = f'{KEY_PREFIX}:{name}:stale'
+    return f'{key}:{suffix}' if suffix else key
+
+
+def _wrap(result):
+    return NONE_RESULT if result is None else result
+
+
+def _unwrap(value):
+    return None if isinstance(value, str) and value == NONE_RESULT else value
+
+
+def _store(key, stale, result, timeout):
+    cache.set_many({key: _wrap(result), stale: _wrap(result)}, timeout)
+    return result
+
+
+def _may_release(acquired):
+    # The cache API has no atomic compare-and-delete. Nobody else can take the
+    # lock before it expires, so deleting it well within its timeout can only
+    # remove our own; past that it is left to expire.
+    return time.monotonic() - acquired < LOCK_TIMEOUT - LOCK_RELEASE_MARGIN
+
+
+def get_or_compute(name, builder, *parts, timeout=RESULT_TIMEOUT, stale=True):
+    """
+    Return the cached result for ``name`` at the current data version,
+    calling ``builder()`` and storing its result on a miss. A None result
+    is cached too.
+
+    Misses are single-flight: one caller takes a lock in the cache and runs
+    ``builder()``, while the others get the previous version's result (when
+    ``stale`` is true and there is one). The lock is an atomic ``cache.add``
+    on the shared backend settings.py requires, so this holds across all
+    workers. A caller with nothing to serve builds the result itself instead
+    of sleeping in a sync worker until the lock holder is done.
+    """
+    key = versioned_key(name, *parts)
+    result = cache.get(key)
+    if result is not None:
+        return _unwrap(result)
+
+    previous = stale_key(name, *parts)
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, True, LOCK_TIMEOUT):
+        acquired = time.monotonic()
+        try:
+            # Another caller may have finished between our miss and the lock
+            result = cache.get(key)
+            if result is not None:
+                return _unwrap(result)
+            return _store(key, previous, builder(), timeout)
+        finally:
+            if _may_release(acquired):
+                cache.delete(lock_key)
+
+    found = cache.get_many([key, previous] if stale else [key])
+    result = found.get(key, found.get(previous))
+    if result is not None:
+        return _unwrap(result)
+    return _store(key, previous, builder(), timeout)
+
+
+_inflight = {}
+
+
+async def coalesce(key, factory):
+    """
+    Await the result of ``factory()``, sharing one in-flight call per ``key``.
+
+    The shared task is shielded, so one caller disconnecting does not cancel
+    the computation for the others.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def aget_data_version():
+    """Async version of ``get_data_version``"""
+    version = await _versions().afirst()
+    if version is None:
+        version = (await SurvivalDataVersion.objects.aget_or_create(
+            pk=DATA_VERSION_ID, defaults={'value': _initial_version()}
+        ))[0].value
+    return version
+
+
+async def _asingle_flight(key, previous, builder, timeout, stale):
+    """Async version of the single-flight loop in ``get_or_compute``"""
+    lock_key = f'{key}:lock'
+    deadline = time.monotonic() + LOCK_WAIT
+    while True:
+        if await cache.aadd(lock_key, True, LOCK_TIMEOUT):
+            acquired = time.monotonic()
+            try:
+                result = await cache.aget(key)
+                if result is not None:
+                    return _unwrap(result)
+                result = await builder()
+                await cache.aset_many({key: _wrap(result), previous: _wrap(result)}, timeout)
+                return result
+            finally:
+                if _may_release(acquired):
+                    await cache.adelete(lock_key)
+
+        found = await cache.aget_many([key, previous] if stale else [key])
+        result = found.get(key, found.get(previous))
+        if result is not None:
+            return _unwrap(result)
+        if time.monotonic() >= deadline:
+            result = await builder()
+            await cache.aset_many({key: _wrap(result), previous: _wrap(result)}, timeout)
+            return result
+        # Waiting here only suspends this request, not the worker
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+
+async def aget_or_compute(name, builder, *parts, timeout=RESULT_TIMEOUT, stale=True):
+    """
+    Async version of ``get_or_compute`` for a coroutine ``builder``.
+
+    Concurrent misses for the same key in this process share one wait on the
+    single-flight lock instead of each polling the cache.
+    """
+    key = versioned_key(name, *parts, version=await aget_data_version())
+    result = await cache.aget(key)
+    if result is not None:
+        return _unwrap(result)
+    return await coalesce(key, lambda: _asingle_flight(
+        key, stale_key(name, *parts), builder, timeout, stale
+    ))
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Backends whose entries are private to one process
+PER_PROCESS_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+# Shared backends whose add() reads and then writes, so two workers can both
+# take the same single-flight lock
+NON_ATOMIC_CACHES = {
+    'django.core.cache.backends.db.DatabaseCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+}
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Cached results must be shared by all workers, and their locks atomic"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+    if backend in PER_PROCESS_CACHES:
+        return [Warning(
+            "The default cache is per-process, so survival results and permission "
+            "snapshots are not shared between worker processes.",
+            hint="Configure a shared CACHES backend (Redis); see settings.py.",
+            id='survival_analysis.W001',
+        )]
+    if backend in NON_ATOMIC_CACHES:
+        return [Warning(
+            "The default cache has no atomic add, so several workers can take the same "
+            "single-flight lock and compute one missing survival result at once.",
+            hint="Use an atomic backend such as Redis (set REDIS_URL) in production; see settings.py.",
+            id='survival_analysis.W002',
+        )]
+    return []
@@ -0,0 +1,40 @@
+"""
+CPU-bound survival work for the async views.
+
+The async views read their rows with the async ORM (and the curves from the
+incrementally maintained counts in a thread), then send only the number
+crunching and figure rendering to a bounded process pool
+(``SURVIVAL_COMPUTE_WORKERS``), so it never blocks the event loop. The
+functions run there take plain data and never touch the database.
+
+Workers are spawned rather than forked (forking a multi-threaded server
+process is unsafe) and run ``django.setup()`` before their first task.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Process-wide compute pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'SURVIVAL_COMPUTE_WORKERS', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        return _pool
+
+
+async def run_in_pool(func, *args):
+    """Run ``func(*args)`` in the compute pool without blocking the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(get_process_pool(), func, *args)
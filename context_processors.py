@@ -1,6 +1,13 @@
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.utils.functional import SimpleLazyObject
 from .models import User
+from .authz import get_authorization
+
+
+def _lazy(request, getter):
+    """Value computed from the user's authorization snapshot only if a template reads it"""
+    return SimpleLazyObject(lambda: getter(get_authorization(request)))
 
 
 def site_info(request):
@@ -24,8 +31,9 @@ def user_roles(request):
         }
 
     try:
-        # Get user's groups
-        groups = list(request.user.groups.values_list('name', flat=True))
+        # Groups and permissions come from the cached per-user snapshot and
+        # are only resolved when a template actually uses them
+        groups = _lazy(request, lambda authorization: authorization.groups)
 
         return {
             'user_role': request.user.role,
@@ -39,9 +47,9 @@ def user_roles(request):
             'user_groups': groups,
             'is_superuser': request.user.is_superuser,
             # Permission flags
-            'can_approve_users': request.user.has_perm('app1.approve_users'),
-            'can_manage_patients': request.user.has_perm('app1.change_patientdemographics'),
-            'can_manage_forms': request.user.has_perm('app1.change_userform')
+            'can_approve_users': _lazy(request, lambda a: a.has_perm('app1.approve_users')),
+            'can_manage_patients': _lazy(request, lambda a: a.has_perm('app1.change_patientdemographics')),
+            'can_manage_forms': _lazy(request, lambda a: a.has_perm('app1.change_userform'))
         }
     except AttributeError:
         # Handle case where custom user attributes aren't available
@@ -59,11 +67,7 @@ def group_permissions(request):
     if not request.user.is_authenticated:
         return {'group_permissions': {}}
 
-    permissions = {}
-    for group in request.user.groups.all():
-        permissions[group.name] = [perm.codename for perm in group.permissions.all()]
-
     return {
-        'group_permissions': permissions,
-        'all_permissions': list(request.user.get_all_permissions())
+        'group_permissions': _lazy(request, lambda authorization: authorization.group_permissions),
+        'all_permissions': _lazy(request, lambda authorization: sorted(authorization.permissions))
     }
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""
+Kaplan-Meier curves for a single group of ``SurvivalData``, as JSON.
+
+The ``survival_curve`` endpoint serves one group's curve, read from the
+incrementally maintained counts in ``incremental.py``, with Greenwood
+confidence bands, so a client can fetch the groups it needs one at a time.
+The results page itself still embeds every diagnosis curve.
+
+Log-rank comparisons between the groups of a grouping are computed from the
+survival snapshot in one vectorized pass (``km.logrank``) and memoized per
+data version alongside the curves.
+"""
+import json
+
+from .models import SurvivalData
+from .cache import get_or_compute
+from .incremental import read_curve
+from .figures import km_figure
+from .km import logrank
+from .snapshot import get_snapshot
+
+EVENT_STATUS = SurvivalData.EVENT_STATUS
+GROUPINGS = SurvivalData.CURVE_GROUPINGS
+
+# Groupings whose log-rank tests are shown on the results page
+COMPARISON_GROUPINGS = ('diagnosis', 'level_of_care')
+
+
+def _build_curve_json(group_by, value):
+    km_df = read_curve(group_by, value)
+    if km_df is None:
+        return None
+    fig = km_figure(km_df, f'<b>{GROUPINGS[group_by]}: {value}</b>', styled=False)
+    return json.dumps({
+        'group_by': group_by,
+        'value': value,
+        'timeline': km_df['timeline'].tolist(),
+        'survival': km_df['KM_estimate'].tolist(),
+        'at_risk': km_df['at_risk'].tolist(),
+        'ci_lower': km_df['ci_lower'].tolist(),
+        'ci_upper': km_df['ci_upper'].tolist(),
+        'figure': json.loads(fig.to_json()),
+    })
+
+
+def curve_json(group_by, value):
+    """Serialized curve and figure for one group, memoized per data version"""
+    return get_or_compute('curve', lambda: _build_curve_json(group_by, value), group_by, value)
+
+
+def _build_comparison(group_by):
+    snapshot = get_snapshot()
+    return logrank(snapshot.durations, snapshot.events, snapshot.labels(group_by))
+
+
+def group_comparison(group_by):
+    """
+    k-group and pairwise log-rank tests between the groups of ``group_by``
+    (see ``km.logrank``), memoized per data version
+    """
+    return get_or_compute('comparison', lambda: _build_comparison(group_by), group_by)
+
+
+def group_comparisons():
+    """``group_comparison`` for every grouping in ``COMPARISON_GROUPINGS``"""
+    return {group_by: group_comparison(group_by) for group_by in COMPARISON_GROUPINGS}
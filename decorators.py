@@ -1,6 +1,8 @@
 from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import redirect
+from django.contrib import messages
 from django.contrib.auth.decorators import user_passes_test
+from .authz import get_authorization
 
 # In decorators.py
 from django.http import HttpResponseForbidden
@@ -12,13 +14,15 @@ def role_required(*roles):
             if not request.user.is_authenticated:
                 return HttpResponseForbidden("Authentication required")
 
+            # Role, groups and permissions are loaded once per request/session
+            authorization = get_authorization(request)
+
             # Check if user has any of the required roles
-            if hasattr(request.user, 'userprofile'):
-                if request.user.userprofile.role in roles:
-                    return view_func(request, *args, **kwargs)
+            if authorization.profile_role in roles:
+                return view_func(request, *args, **kwargs)
 
             # Fallback to group check
-            if any(request.user.groups.filter(name__iexact=role).exists() for role in roles):
+            if authorization.in_group_iexact(*roles):
                 return view_func(request, *args, **kwargs)
 
             return HttpResponseForbidden("You don't have permission to access this page")
@@ -67,7 +71,8 @@ def staff_required(view_func):
 
 def admin_required(view_func):
     def wrapper_func(request, *args, **kwargs):
-        if request.user.is_superuser or request.user.groups.filter(name='admin').exists():
+        authorization = get_authorization(request)
+        if authorization.is_superuser or authorization.in_group('admin'):
             return view_func(request, *args, **kwargs)
         else:
             messages.error(request, "Admin access required")
@@ -80,9 +85,7 @@ def allowed_users(allowed_roles = []):
     def decorator(view_func):
         def wrapper_func(request, *args, **kwargs):
 
-            group = None
-            if request.user.groups.exists():
-                group = request.user.groups.all()[0].name
+            group = get_authorization(request).primary_group
 
             if group in allowed_roles:
                 return view_func(request, *args, **kwargs)
@@ -93,9 +96,7 @@ def allowed_users(allowed_roles = []):
 
 def admin_only(view_func):
     def wrapper_function(request, *args, **kwargs):
-        group = None
-        if request.user.groups.exists():
-            group = request.user.groups.all()[0].name
+        group = get_authorization(request).primary_group
 
         if group == 'staff':
             return redirect('ME_Dashboard')
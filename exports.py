@@ -0,0 +1,135 @@
+"""
+Constant-memory exports of ``SurvivalData``.
+
+Rows are pulled with ``values_list(...).iterator(chunk_size=...)`` and choice
+labels are resolved from precomputed dicts, so only one chunk of rows is held
+in memory at a time regardless of table size.
+
+The .xlsx export holds patient names, so it is built per request into a
+private temporary file and never written to (publicly served) media storage.
+"""
+import csv
+import tempfile
+from itertools import islice
+
+from openpyxl import Workbook
+
+from app1.models import PatientDemographics
+from .models import SurvivalData
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_HEADERS = [
+    'Patient ID', 'Patient Name', 'Diagnosis',
+    'Days in Care', 'Place of Death', 'Date of Death',
+    'Status', 'Level of Care'
+]
+
+POD_LABELS = dict(SurvivalData.POD_CHOICES)
+STATUS_LABELS = dict(SurvivalData.STATUS_CHOICES)
+CARE_LEVEL_LABELS = dict(SurvivalData.CARE_LEVEL_CHOICES)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _export_row(record, patients):
+    patient_id, diagnosis, days, pod, dod, status, level = record
+    return [
+        patient_id,
+        str(patients[patient_id]) if patient_id in patients else '',
+        diagnosis,
+        days or '',
+        POD_LABELS.get(pod, pod) if pod else '',
+        dod.strftime('%Y-%m-%d') if dod else '',
+        STATUS_LABELS.get(status, status),
+        CARE_LEVEL_LABELS.get(level, level) if level else '',
+    ]
+
+
+def iter_export_rows(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one export row per ``SurvivalData`` record, in primary key order"""
+    records = SurvivalData.objects.order_by('pk').values_list(
+        'patient_id', 'diagnosis', 'days_in_care', 'pod', 'dod',
+        'file_status', 'level_of_care'
+    ).iterator(chunk_size=chunk_size)
+
+    for chunk in _chunks(records, chunk_size):
+        # Patient names come from PatientDemographics.__str__, one query per chunk
+        patients = PatientDemographics.objects.in_bulk({row[0] for row in chunk})
+        for record in chunk:
+            yield _export_row(record, patients)
+
+
+class Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the export as CSV text, one line at a time"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_HEADERS)
+    for row in iter_export_rows(chunk_size):
+        yield writer.writerow(row)
+
+
+def write_xlsx(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Write the export to a temporary .xlsx file using a write-only workbook.
+
+    Write-only worksheets flush rows to disk as they are appended, so memory
+    stays flat. Returns the open file, rewound and ready to stream.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Survival Data")
+    ws.append(EXPORT_HEADERS)
+    for row in iter_export_rows(chunk_size):
+        ws.append(row)
+
+    output = tempfile.TemporaryFile()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+async def aiter_export_rows(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Async version of ``iter_export_rows`` using the async ORM.
+
+    Pages by primary key rather than ``aiterator()``, which evaluates
+    values_list() querysets outside the sync thread on some Django versions.
+    """
+    records = SurvivalData.objects.order_by('pk').values_list(
+        'pk', 'patient_id', 'diagnosis', 'days_in_care', 'pod', 'dod',
+        'file_status', 'level_of_care'
+    )
+
+    last_pk = 0
+    while True:
+        chunk = [row async for row in records.filter(pk__gt=last_pk)[:chunk_size]]
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        for export_row in await _aexport_chunk([row[1:] for row in chunk]):
+            yield export_row
+        if len(chunk) < chunk_size:
+            break
+
+
+async def _aexport_chunk(chunk):
+    patients = await PatientDemographics.objects.ain_bulk({row[0] for row in chunk})
+    return [_export_row(record, patients) for record in chunk]
+
+
+async def aiter_csv(chunk_size=EXPORT_CHUNK_SIZE):
+    """Async version of ``iter_csv``, for StreamingHttpResponse under ASGI"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_HEADERS)
+    async for row in aiter_export_rows(chunk_size):
+        yield writer.writerow(row)
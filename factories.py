@@ -0,0 +1,52 @@
+"""
+Rows with synthetic values for every required field, for tests and the
+survival benchmark, which only care about a few fields of each model.
+"""
+import datetime
+
+from django.db import models
+from django.utils import timezone
+
+
+def required_fields(model, exclude=()):
+    """Concrete fields of ``model`` that must be given a value on create"""
+    return [
+        field for field in model._meta.concrete_fields
+        if not (field.primary_key or field.null or field.has_default() or field.name in exclude
+                or getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False))
+    ]
+
+
+def placeholder(field, index):
+    """Synthetic value for the required ``field`` of the ``index``-th row"""
+    if field.choices:
+        return field.choices[0][0]
+    if isinstance(field, models.EmailField):
+        return f'user{index}@example.com'
+    if isinstance(field, (models.CharField, models.TextField)):
+        return f'{field.name}{index}'[:field.max_length or None]
+    if isinstance(field, models.DateTimeField):
+        return timezone.now()
+    if isinstance(field, models.DateField):
+        return datetime.date(1940, 1, 1) + datetime.timedelta(days=index % 20000)
+    if isinstance(field, models.BooleanField):
+        return False
+    if isinstance(field, (models.IntegerField, models.FloatField, models.DecimalField)):
+        return index % 100
+    raise ValueError(f"No placeholder for {field.model.__name__}.{field.name}")
+
+
+def make(model, index, **values):
+    """
+    Create a ``model`` row from ``values``, with placeholders for the
+    required fields not given. A required foreign key gets a new related
+    row of its own, made the same way.
+    """
+    for field in required_fields(model):
+        if field.name in values or field.attname in values:
+            continue
+        if field.is_relation:
+            values[field.name] = make(field.related_model, index)
+        else:
+            values[field.name] = placeholder(field, index)
+    return model.objects.create(**values)
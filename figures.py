@@ -0,0 +1,81 @@
+"""
+Plotly figure rendering for the survival pages.
+
+Figures carry only their figure JSON and a small ``Plotly.newPlot`` call.
+The plotly.js bundle itself is served once by the ``plotly_js`` view under a
+versioned URL with far-future caching. The first figure on a page is
+rendered with ``include_plotlyjs=plotly_js_url()``, for which plotly emits a
+script tag loading that URL, and the figures after it reuse the bundle.
+"""
+from functools import lru_cache
+
+import plotly.express as px
+import plotly.graph_objects as go
+from django.urls import reverse
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+
+KM_AXIS_LABELS = {
+    'timeline': 'Time (days)',
+    'KM_estimate': 'Survival Probability'
+}
+
+
+@lru_cache(maxsize=1)
+def plotly_js_source():
+    """The plotly.js bundle shipped with the installed plotly package"""
+    return get_plotlyjs()
+
+
+def plotly_js_url():
+    """Versioned URL of the shared plotly.js bundle, safe to cache forever"""
+    return reverse('plotly_js', args=[get_plotlyjs_version()])
+
+
+def km_figure(km_df, title, styled=True):
+    """
+    Line chart of a Kaplan-Meier curve from ``km.grouped_kaplan_meier``,
+    with its confidence band shaded behind it
+    """
+    km_df = km_df.rename(columns=KM_AXIS_LABELS)
+    fig = px.line(
+        km_df,
+        x='Time (days)',
+        y='Survival Probability',
+        title=title
+    )
+    if 'ci_lower' in km_df:
+        band = dict(x=km_df['Time (days)'], mode='lines', line=dict(width=0),
+                    hoverinfo='skip', showlegend=False)
+        fig.add_traces([
+            go.Scatter(y=km_df['ci_upper'], **band),
+            go.Scatter(y=km_df['ci_lower'], fill='tonexty', fillcolor='rgba(99, 110, 250, 0.2)', **band),
+        ])
+        # Traces draw in order: move the curve after its band so it stays on top
+        fig.data = fig.data[1:] + fig.data[:1]
+    if styled:
+        fig.update_layout(
+            hovermode="x unified",
+            plot_bgcolor='white',
+            xaxis=dict(gridcolor='lightgray'),
+            yaxis=dict(gridcolor='lightgray', range=[0, 1])
+        )
+    return fig
+
+
+def overall_graph_figure(km_df):
+    """Overall curve as plotted on the predictive analytics page"""
+    return px.line(
+        km_df,
+        x='timeline',
+        y='KM_estimate',
+        title='Overall Survival Curve',
+        labels={'timeline': 'Days in Care', 'KM_estimate': 'Survival Probability'}
+    )
+
+
+def render_figure(fig, include_plotlyjs=False):
+    """
+    Render ``fig`` as an HTML fragment. Pass ``plotly_js_url()`` as
+    ``include_plotlyjs`` for the first figure on the page.
+    """
+    return fig.to_html(full_html=False, include_plotlyjs=include_plotlyjs)
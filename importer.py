@@ -0,0 +1,189 @@
+"""
+Batched import of hospice survival spreadsheets into ``SurvivalData``.
+
+The whole sheet is validated and normalized with vectorized pandas
+operations, every referral number is resolved with one ``__in`` query, and
+rows are written with ``bulk_create``/``bulk_update`` in chunks inside a
+single transaction. Rows that cannot be imported are reported back instead
+of being skipped silently.
+"""
+import re
+
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+
+from app1.models import PatientDemographics
+from .models import SurvivalData
+from .cache import bump_data_version
+
+BATCH_SIZE = 1000
+HEADER_ROWS = 1  # Spreadsheet row numbers in the report are 1-based, after the header
+
+UPDATE_FIELDS = [
+    'diagnosis', 'days_in_care', 'pod', 'dod',
+    'date_case_registered', 'file_status', 'level_of_care', 'event',
+]
+
+
+def _choice_key(series):
+    """Normalize free text such as 'Closed - Died' to 'closed_died'"""
+    return (series.astype(str).str.strip().str.lower()
+            .str.replace(r'[^a-z0-9]+', '_', regex=True).str.strip('_'))
+
+
+def _choice_lookup(choices):
+    """Map both stored values and display labels (normalized) to the stored value"""
+    lookup = {}
+    for value, label in choices:
+        for text in (value, label):
+            lookup[re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')] = value
+    return lookup
+
+
+def _map_choices(df, column, choices, default=None):
+    """
+    Vectorized choice normalization for ``column``.
+
+    Returns the mapped values (``default`` where blank) and a mask of rows
+    whose value is not a recognized choice.
+    """
+    if column not in df.columns:
+        return pd.Series(default, index=df.index, dtype=object), pd.Series(False, index=df.index)
+
+    raw = df[column]
+    blank = raw.isna() | (raw.astype(str).str.strip() == '')
+    mapped = _choice_key(raw).map(_choice_lookup(choices))
+    invalid = ~blank & mapped.isna()
+    mapped = mapped.astype(object).where(~blank, default)
+    return mapped.where(mapped.notna(), None), invalid
+
+
+def _dates(df, column, default=None):
+    if column not in df.columns:
+        return pd.Series(default, index=df.index, dtype=object), pd.Series(False, index=df.index)
+    parsed = pd.to_datetime(df[column], errors='coerce')
+    invalid = df[column].notna() & parsed.isna()
+    values = parsed.dt.date.astype(object).where(parsed.notna(), default)
+    return values, invalid
+
+
+def normalize_survival_frame(df):
+    """
+    Turn a raw survival spreadsheet into a frame of model-ready values.
+
+    Returns ``(frame, errors)`` where ``errors`` maps a DataFrame index to the
+    reason that row cannot be imported.
+    """
+    errors = {}
+
+    def flag(mask, message):
+        for index in df.index[mask]:
+            errors.setdefault(index, message)
+
+    out = pd.DataFrame(index=df.index)
+
+    refs = df['Ref Number']
+    missing_ref = refs.isna() | (refs.astype(str).str.strip() == '')
+    flag(missing_ref, 'Missing Ref Number')
+    out['referral_number'] = refs.astype(str).str.strip().where(~missing_ref, None)
+
+    out['diagnosis'] = (df['Diagnosis'].fillna('').astype(str).str.strip()
+                        if 'Diagnosis' in df.columns else '')
+
+    if 'DaysInCare' in df.columns:
+        days = pd.to_numeric(df['DaysInCare'], errors='coerce')
+        flag(df['DaysInCare'].notna() & days.isna(), 'DaysInCare is not a number')
+        flag(days < 0, 'DaysInCare cannot be negative')
+        out['days_in_care'] = days.astype(object).where(days.notna(), None)
+    else:
+        out['days_in_care'] = None
+
+    out['dod'], invalid = _dates(df, 'Dod')
+    flag(invalid, 'Dod is not a valid date')
+    out['date_case_registered'], invalid = _dates(df, 'DateCaseRegistered', timezone.now().date())
+    flag(invalid, 'DateCaseRegistered is not a valid date')
+
+    out['pod'], invalid = _map_choices(df, 'Pod', SurvivalData.POD_CHOICES)
+    flag(invalid, 'Unknown Pod')
+    out['file_status'], invalid = _map_choices(df, 'FileStatus', SurvivalData.STATUS_CHOICES, 'active')
+    flag(invalid, 'Unknown FileStatus')
+    # bulk_create/bulk_update bypass SurvivalData.save(), so derive the flag here
+    out['event'] = out['file_status'] == SurvivalData.EVENT_STATUS
+    out['level_of_care'], invalid = _map_choices(df, 'Levelofcare', SurvivalData.CARE_LEVEL_CHOICES)
+    flag(invalid, 'Unknown Levelofcare')
+
+    return out, errors
+
+
+def import_survival_frame(df, batch_size=BATCH_SIZE, row_offset=0):
+    """
+    Create or update ``SurvivalData`` rows from a survival spreadsheet.
+
+    Like the old per-row ``update_or_create``, rows are matched to existing
+    records by patient and a later row for the same patient wins.
+
+    ``row_offset`` shifts the reported row numbers when ``df`` is one chunk
+    of a larger sheet.
+
+    Returns a report dict with ``created`` and ``updated`` counts and an
+    ``errors`` list of ``{'row', 'referral_number', 'error'}`` entries.
+    """
+    report = {'created': 0, 'updated': 0, 'errors': []}
+    if 'Ref Number' not in df.columns:
+        report['errors'].append({'row': None, 'referral_number': None,
+                                 'error': "Missing required column 'Ref Number'"})
+        return report
+
+    df = df.reset_index(drop=True)
+    rows, errors = normalize_survival_frame(df)
+
+    # Resolve every referral number with a single query
+    patient_ids = {
+        str(ref): pk for ref, pk in PatientDemographics.objects.filter(
+            referral_number__in=rows['referral_number'].unique().tolist()
+        ).values_list('referral_number', 'id')
+    }
+    rows['patient_id'] = rows['referral_number'].map(patient_ids)
+    for index in rows.index[rows['patient_id'].isna()]:
+        errors.setdefault(index, 'No patient with this referral number')
+
+    for index in sorted(errors):
+        report['errors'].append({
+            'row': index + row_offset + HEADER_ROWS + 1,
+            'referral_number': rows.at[index, 'referral_number'],
+            'error': errors[index],
+        })
+
+    valid = rows.drop(index=list(errors)).drop_duplicates('patient_id', keep='last')
+    if valid.empty:
+        return report
+
+    valid = valid.astype({'patient_id': int})
+    existing = {}
+    for patient_id, pk in SurvivalData.objects.filter(
+            patient_id__in=valid['patient_id'].tolist()
+    ).order_by('-pk').values_list('patient_id', 'pk'):
+        existing[patient_id] = pk  # Lowest pk wins, as with update_or_create's get()
+
+    # Blank cells become None rather than NaN on the model fields
+    valid = valid.astype(object).where(valid.notna(), None)
+
+    creates, updates = [], []
+    for record in valid.to_dict('records'):
+        values = {field: record[field] for field in UPDATE_FIELDS}
+        pk = existing.get(record['patient_id'])
+        obj = SurvivalData(pk=pk, patient_id=record['patient_id'], **values)
+        (updates if pk else creates).append(obj)
+
+    with transaction.atomic():
+        SurvivalData.objects.bulk_create(creates, batch_size=batch_size)
+        SurvivalData.objects.bulk_update(updates, UPDATE_FIELDS, batch_size=batch_size)
+
+    # Bulk writes bypass post_save, so invalidate cached curves explicitly,
+    # once the rows are visible to other connections
+    transaction.on_commit(bump_data_version)
+
+    report['created'] = len(creates)
+    report['updated'] = len(updates)
+    return report
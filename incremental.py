@@ -0,0 +1,170 @@
+"""
+Incrementally maintained Kaplan-Meier counts for ``SurvivalData``.
+
+``SurvivalCounts`` keeps, for the overall population and for every
+diagnosis, level_of_care and pod group, the number of deaths and exits at
+each distinct ``days_in_care``. The distinct durations are kept in one
+sorted array and every count table has a column per entry, so memory grows
+with the number of distinct durations, not with the longest one. Adding,
+changing or removing a record finds its column with a binary search
+(``np.searchsorted``); only a duration never seen before inserts a column.
+A curve is read from the non-zero columns with the cumulative sums in
+``km.curve_from_counts`` instead of being refit from the rows.
+
+The counts follow the survival snapshot (``snapshot.py``). The receivers
+only log which patients each committed change touched. When the data
+version moves on, each process carries its counts forward by retracting
+those patients' rows as they were in its old snapshot and adding them as
+they are in the new one. Both sides come from snapshots rather than from
+signal payloads, so a change a rebuild has already picked up is never
+counted twice. When a step's log is missing (a bulk import, an evicted key)
+the counts are rebuilt from the snapshot. Nothing but the small change logs
+passes through the cache.
+"""
+import threading
+
+import numpy as np
+
+from .km import curve_from_counts
+from .snapshot import GROUPINGS, changes_since, get_snapshot
+
+# Rebuild rather than carry the counts forward past this many changed patients
+MAX_PATCHED_PATIENTS = 5000
+
+OVERALL = None
+
+
+class SurvivalCounts:
+    """
+    Deaths and exits per duration, overall and per group, for one ``Snapshot``.
+
+    ``times`` holds the sorted distinct durations seen so far.
+    ``observed[key]`` and ``removed[key]`` are (groups x times) arrays, one
+    row per label in ``labels[key]``; the overall counts are the single row
+    of the ``OVERALL`` key.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.labels = {group_by: [] for group_by in GROUPINGS}
+        self.times = np.zeros(0, dtype=np.int64)
+        self.observed = {key: np.zeros((0 if key else 1, 0), dtype=np.int64) for key in [OVERALL, *GROUPINGS]}
+        self.removed = {key: np.zeros_like(counts) for key, counts in self.observed.items()}
+        self._add(snapshot, np.arange(len(snapshot)), 1)
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def _codes(self, snapshot, group_by, rows):
+        """Row indices into ``labels[group_by]`` for ``rows`` of ``snapshot`` (-1 where blank)"""
+        labels = self.labels[group_by]
+        index = {label: i for i, label in enumerate(labels)}
+        mapping = []
+        for label in snapshot.categories[group_by]:
+            if label not in index:
+                index[label] = len(labels)
+                labels.append(label)
+            mapping.append(index[label])
+        codes = np.asarray(snapshot[group_by][rows])
+        # Blank groups (NO_GROUP, -1) pick the trailing -1
+        return np.array(mapping + [-1], dtype=np.int64)[codes]
+
+    def _columns(self, durations):
+        """Column indices of ``durations`` in ``times``, inserting columns for new durations"""
+        new = np.setdiff1d(durations, self.times)
+        if len(new):
+            at = np.searchsorted(self.times, new)
+            self.times = np.insert(self.times, at, new)
+            for counts in (self.observed, self.removed):
+                for key, table in counts.items():
+                    counts[key] = np.insert(table, at, 0, axis=1)
+        return np.searchsorted(self.times, durations)
+
+    def _reserve(self, key, groups):
+        missing = groups - self.observed[key].shape[0]
+        if missing <= 0:
+            return
+        for counts in (self.observed, self.removed):
+            counts[key] = np.vstack([counts[key], np.zeros((missing, len(self.times)), dtype=np.int64)])
+
+    def _add(self, snapshot, rows, sign):
+        if not len(rows):
+            return
+        columns = self._columns(np.asarray(snapshot.durations[rows], dtype=np.int64))
+        events = np.asarray(snapshot.events[rows], dtype=np.int64)
+
+        for key in [OVERALL, *GROUPINGS]:
+            if key is OVERALL:
+                codes = np.zeros(len(rows), dtype=np.int64)
+            else:
+                codes = self._codes(snapshot, key, rows)
+            self._reserve(key, len(self.labels[key]) if key else 1)
+            keep = codes >= 0
+            np.add.at(self.removed[key], (codes[keep], columns[keep]), sign)
+            np.add.at(self.observed[key], (codes[keep], columns[keep]), sign * events[keep])
+
+    def advance(self, snapshot, patient_ids):
+        """Carry the counts forward to ``snapshot``, in which only ``patient_ids`` changed"""
+        patient_ids = np.fromiter(patient_ids, dtype=np.int64)
+        self._add(self.snapshot, np.flatnonzero(np.isin(self.snapshot['patient_id'], patient_ids)), -1)
+        self._add(snapshot, np.flatnonzero(np.isin(snapshot['patient_id'], patient_ids)), 1)
+        self.snapshot = snapshot
+
+    def _row(self, group_by, value):
+        if group_by is None:
+            return 0
+        try:
+            return self.labels[group_by].index(value)
+        except ValueError:
+            return None
+
+    def curve(self, group_by=None, value=None):
+        """Kaplan-Meier curve of one group (overall by default), or None"""
+        row = self._row(group_by, value)
+        if row is None:
+            return None
+        removed = self.removed[group_by][row]
+        columns = np.flatnonzero(removed)
+        if not len(columns):
+            return None
+        return curve_from_counts(self.times[columns], self.observed[group_by][row][columns], removed[columns])
+
+    def group_values(self, group_by):
+        """Sorted labels of ``group_by`` with at least one record"""
+        totals = self.removed[group_by].sum(axis=1)
+        return sorted(label for label, total in zip(self.labels[group_by], totals) if total)
+
+
+_local = {'counts': None}
+_local_lock = threading.Lock()
+
+
+def _current_counts():
+    """Counts for the current snapshot, carried forward or rebuilt; call with ``_local_lock`` held"""
+    snapshot = get_snapshot()
+    counts = _local['counts']
+    if counts is not None and counts.version == snapshot.version:
+        return counts
+
+    changed = None
+    if counts is not None and counts.version < snapshot.version:
+        changed = changes_since(counts.version, snapshot.version)
+    if changed is None or len(changed) > MAX_PATCHED_PATIENTS:
+        counts = SurvivalCounts(snapshot)
+    else:
+        counts.advance(snapshot, changed)
+    _local['counts'] = counts
+    return counts
+
+
+def read_curve(group_by=None, value=None):
+    """Kaplan-Meier curve of one group (overall by default) from the live counts"""
+    with _local_lock:
+        return _current_counts().curve(group_by, value)
+
+
+def read_group_values(group_by):
+    """Sorted values of ``group_by`` that have at least one record with a duration"""
+    with _local_lock:
+        return _current_counts().group_values(group_by)
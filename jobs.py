@@ -0,0 +1,188 @@
+"""
+Background execution of survival spreadsheet imports and risk rescoring.
+
+Uploads are stored on a ``SurvivalImportJob`` and processed by a local
+worker pool (threads by default, or processes with
+``SURVIVAL_IMPORT_EXECUTOR = 'process'``), so no external broker is needed.
+The sheet is imported in chunks; each chunk and the job's checkpoint are
+committed together, so an interrupted job resumes after its last committed
+chunk (see the ``resume_survival_imports`` management command).
+
+A worker claims a job by stamping ``heartbeat_at`` and refreshes the stamp
+with every chunk. A job is only picked up again once that stamp is older
+than ``JOB_LEASE``, so resuming never runs a job that is still alive.
+
+Rescoring every active patient (``submit_risk_scoring``) runs on the same
+pool, at most one queued run per process.
+"""
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+import pandas as pd
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import SurvivalImportJob
+from .importer import import_survival_frame
+from .risk import score_active_patients
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = getattr(settings, 'SURVIVAL_IMPORT_CHUNK_ROWS', 5000)
+MAX_STORED_ERRORS = 1000  # Keep the job row small on very dirty sheets
+
+# A running job whose worker has not checked in for this long is presumed dead
+JOB_LEASE = timedelta(minutes=10)
+
+_executor = None
+_executor_lock = threading.Lock()
+_scoring = None
+_scoring_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide import worker pool, creating it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'SURVIVAL_IMPORT_WORKERS', 2)
+            if getattr(settings, 'SURVIVAL_IMPORT_EXECUTOR', 'thread') == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers,
+                                               thread_name_prefix='survival-import')
+        return _executor
+
+
+def _submit(func, *args):
+    executor = get_executor()
+    if isinstance(executor, ProcessPoolExecutor):
+        # Worker processes may be forked here; they must not inherit (and
+        # share the sockets of) this process's database connections
+        connections.close_all()
+    return executor.submit(func, *args)
+
+
+def submit_import_job(job):
+    """Queue ``job`` on the worker pool once its row has been committed"""
+    transaction.on_commit(lambda: _submit(run_import_job, job.pk))
+
+
+def run_risk_scoring():
+    """Worker entry point for ``score_active_patients``"""
+    close_old_connections()
+    try:
+        return score_active_patients()
+    finally:
+        close_old_connections()
+
+
+def _log_scoring_failure(future):
+    # Nobody waits on the future, so its exception would otherwise be lost
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Risk rescoring failed", exc_info=future.exception())
+
+
+def submit_risk_scoring():
+    """
+    Queue a rescoring of every active patient on the worker pool. Returns
+    False if a run queued from this process has not finished yet.
+    """
+    global _scoring
+    with _scoring_lock:
+        if _scoring is not None and not _scoring.done():
+            return False
+        _scoring = _submit(run_risk_scoring)
+        _scoring.add_done_callback(_log_scoring_failure)
+    return True
+
+
+def _claimable():
+    """Unfinished jobs that no live worker holds"""
+    return Q(status__in=['pending', 'running']) & (
+        Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=timezone.now() - JOB_LEASE)
+    )
+
+
+def _claim(job_id):
+    """Take the lease on ``job_id``; False if another worker holds it or it is finished"""
+    return SurvivalImportJob.objects.filter(_claimable(), pk=job_id).update(heartbeat_at=timezone.now()) == 1
+
+
+def run_import_job(job_id):
+    """Worker entry point; takes a primary key so it can cross process boundaries"""
+    close_old_connections()
+    try:
+        if _claim(job_id):
+            _process_job(SurvivalImportJob.objects.get(pk=job_id))
+    finally:
+        close_old_connections()
+
+
+def stale_jobs():
+    """Unfinished jobs whose worker is gone (or that never reached one)"""
+    return SurvivalImportJob.objects.filter(_claimable())
+
+
+def resume_pending_jobs():
+    """Run every abandoned job to completion in the current process"""
+    for job_id in stale_jobs().order_by('created_at').values_list('pk', flat=True):
+        run_import_job(job_id)
+
+
+def _fail(job, message):
+    job.status = 'failed'
+    job.message = message
+    job.finished_at = timezone.now()
+    job.file.delete(save=False)  # Patient data is not kept once the job is over
+    job.save(update_fields=['status', 'message', 'finished_at', 'file'])
+
+
+def _process_job(job):
+    if job.status in ('completed', 'failed'):
+        return
+
+    try:
+        with job.file.open('rb') as fh:
+            df = pd.read_excel(fh)
+    except Exception as e:
+        _fail(job, f'Could not read spreadsheet: {str(e)}')
+        return
+
+    job.status = 'running'
+    job.total_rows = len(df)
+    job.started_at = job.started_at or timezone.now()
+    job.heartbeat_at = timezone.now()
+    job.save(update_fields=['status', 'total_rows', 'started_at', 'heartbeat_at'])
+
+    for chunk_index, start in enumerate(range(0, len(df), CHUNK_ROWS)):
+        if chunk_index <= job.last_chunk:
+            continue  # Already committed before the job was interrupted
+
+        try:
+            with transaction.atomic():
+                report = import_survival_frame(df.iloc[start:start + CHUNK_ROWS], row_offset=start)
+                job.processed_rows = min(start + CHUNK_ROWS, len(df))
+                job.created_count += report['created']
+                job.updated_count += report['updated']
+                job.errors = (job.errors + report['errors'])[:MAX_STORED_ERRORS]
+                job.error_count += len(report['errors'])
+                job.last_chunk = chunk_index
+                job.heartbeat_at = timezone.now()
+                job.save(update_fields=[
+                    'processed_rows', 'created_count', 'updated_count', 'errors', 'error_count',
+                    'last_chunk', 'heartbeat_at',
+                ])
+        except Exception as e:
+            _fail(job, f'Error importing rows {start + 2}-{start + CHUNK_ROWS + 1}: {str(e)}')
+            return
+
+    job.status = 'completed'
+    job.processed_rows = job.total_rows
+    job.finished_at = timezone.now()
+    job.file.delete(save=False)
+    job.save(update_fields=['status', 'processed_rows', 'finished_at', 'file'])
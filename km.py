@@ -0,0 +1,315 @@
+"""
+Vectorized Kaplan-Meier estimator.
+
+``grouped_kaplan_meier`` fits the product-limit curve for every group of a
+covariate (diagnosis, level_of_care, pod, ...) in a single pass: the rows are
+sorted once by (group, duration), collapsed to one row per distinct
+(group, duration) pair, and the risk sets and survival products are derived
+with cumulative sums instead of refitting ``KaplanMeierFitter`` per group.
+
+Each curve is returned as a DataFrame shaped like
+``KaplanMeierFitter.survival_function_.reset_index()`` (``timeline`` and
+``KM_estimate`` columns, timeline starting at 0) so it can be handed to
+Plotly unchanged, with exponential Greenwood confidence bands alongside.
+
+``logrank`` compares the groups (a k-group test plus every pair) from the
+same sorted risk-set table, and ``grouped_survival`` returns the curves and
+the tests from a single pass.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2, norm
+
+CURVE_COLUMNS = ['timeline', 'KM_estimate', 'at_risk', 'observed', 'censored', 'ci_lower', 'ci_upper']
+
+# Confidence level of the bands: 1 - ALPHA
+ALPHA = 0.05
+
+RiskSets = namedtuple('RiskSets', [
+    'labels', 'pair_codes', 'times', 'observed', 'removed', 'at_risk',
+    'group_starts', 'group_codes', 'group_of_pair', 'group_sizes',
+])
+
+
+def _event_table(durations, events, codes):
+    """
+    Collapse rows sorted by (code, duration) into one row per distinct pair.
+
+    Returns the pair codes, times, death counts and removal counts.
+    """
+    order = np.lexsort((durations, codes))
+    codes = codes[order]
+    durations = durations[order]
+    events = events[order]
+
+    # A new (group, duration) pair starts wherever either key changes
+    starts = np.ones(len(durations), dtype=bool)
+    starts[1:] = (codes[1:] != codes[:-1]) | (durations[1:] != durations[:-1])
+    pair_index = np.flatnonzero(starts)
+
+    removed = np.diff(np.append(pair_index, len(durations)))
+    observed = np.add.reduceat(events, pair_index)
+    return codes[pair_index], durations[pair_index], observed, removed
+
+
+def _within_group_cumsum(values, group_starts, group_of_row):
+    """Cumulative sum of ``values`` that restarts at each group boundary"""
+    total = np.cumsum(values)
+    offset = np.concatenate(([0], total))[group_starts]
+    return total - offset[group_of_row]
+
+
+def _factorize(durations, events, groups):
+    durations = pd.to_numeric(pd.Series(durations), errors='coerce').to_numpy(dtype=float)
+    events = pd.Series(events).fillna(0).to_numpy(dtype=float).astype(np.int64)
+
+    if groups is None:
+        codes = np.zeros(len(durations), dtype=np.int64)
+        labels = [None]
+    else:
+        codes, labels = pd.factorize(pd.Series(groups), sort=True)
+        labels = list(labels)
+
+    keep = ~np.isnan(durations) & (codes >= 0)
+    return durations[keep], events[keep], codes[keep], labels
+
+
+def risk_sets(durations, events, groups=None):
+    """
+    Sorted risk-set table shared by the curves and the log-rank tests, or
+    None when no row has both a duration and a group.
+
+    One entry per distinct (group, duration) pair, ordered by group then
+    time, with its deaths, exits and number at risk.
+    """
+    durations, events, codes, labels = _factorize(durations, events, groups)
+    if not len(durations):
+        return None
+
+    pair_codes, times, observed, removed = _event_table(durations, events, codes)
+
+    # Index of the first pair belonging to each group, and each pair's group slot
+    group_starts = np.flatnonzero(np.concatenate(([True], pair_codes[1:] != pair_codes[:-1])))
+    group_codes = pair_codes[group_starts]
+    group_of_pair = np.repeat(np.arange(len(group_starts)),
+                              np.diff(np.append(group_starts, len(pair_codes))))
+
+    # Risk set: everyone in the group minus those removed at earlier times
+    group_sizes = np.bincount(codes, minlength=len(labels))[group_codes]
+    removed_before = _within_group_cumsum(removed, group_starts, group_of_pair) - removed
+    at_risk = group_sizes[group_of_pair] - removed_before
+
+    return RiskSets(labels, pair_codes, times, observed, removed, at_risk,
+                    group_starts, group_codes, group_of_pair, group_sizes)
+
+
+def _greenwood_bands(survival, variance, alpha=ALPHA):
+    """
+    Exponential Greenwood bands: a symmetric interval on log(-log S),
+    mapped back so the bounds stay within [0, 1].
+    """
+    z = norm.ppf(1 - alpha / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_survival = np.log(survival)
+        spread = z * np.sqrt(variance) / log_survival
+        lower = np.exp(-np.exp(np.log(-log_survival) - spread))
+        upper = np.exp(-np.exp(np.log(-log_survival) + spread))
+    # The bounds collapse onto S where it is exactly 1 or 0
+    lower = np.where(np.isnan(lower), survival, lower)
+    upper = np.where(np.isnan(upper), survival, upper)
+    return lower, upper
+
+
+def _curves(sets):
+    """Kaplan-Meier curve with confidence bands for every group of ``sets``"""
+    group_starts, group_of_pair = sets.group_starts, sets.group_of_pair
+    observed, at_risk = sets.observed, sets.at_risk
+
+    # Product-limit estimate as exp(cumsum(log(1 - d/n))); factors of exactly
+    # zero are tracked separately so the log never sees -inf.
+    factor = 1.0 - observed / at_risk
+    is_zero = factor <= 0
+    log_factor = np.log(np.where(is_zero, 1.0, factor))
+    log_survival = _within_group_cumsum(log_factor, group_starts, group_of_pair)
+    zeros_seen = _within_group_cumsum(is_zero.astype(np.int64), group_starts, group_of_pair)
+    survival = np.where(zeros_seen > 0, 0.0, np.exp(log_survival))
+
+    # Greenwood's sum of d / (n (n - d)), restarting per group; it is only
+    # infinite once the curve has reached zero, where the bands are zero too
+    with np.errstate(divide='ignore'):
+        terms = np.where(is_zero, 0.0, observed / (at_risk * (at_risk - observed)))
+    variance = _within_group_cumsum(terms, group_starts, group_of_pair)
+    ci_lower, ci_upper = _greenwood_bands(survival, variance)
+
+    censored = sets.removed - observed
+    curves = {}
+    bounds = np.append(group_starts, len(sets.pair_codes))
+    for slot, code in enumerate(sets.group_codes):
+        lo, hi = bounds[slot], bounds[slot + 1]
+        curve = pd.DataFrame({
+            'timeline': sets.times[lo:hi],
+            'KM_estimate': survival[lo:hi],
+            'at_risk': at_risk[lo:hi],
+            'observed': observed[lo:hi],
+            'censored': censored[lo:hi],
+            'ci_lower': ci_lower[lo:hi],
+            'ci_upper': ci_upper[lo:hi],
+        }, columns=CURVE_COLUMNS)
+        if sets.times[lo] > 0:
+            # Like lifelines, every curve starts at time 0 with S(0) = 1
+            start = pd.DataFrame([[0.0, 1.0, sets.group_sizes[slot], 0, 0, 1.0, 1.0]], columns=CURVE_COLUMNS)
+            curve = pd.concat([start, curve], ignore_index=True)
+        curves[sets.labels[code]] = curve
+    return curves
+
+
+def _death_and_risk_matrices(sets):
+    """
+    Deaths and numbers at risk per group (rows) at every time with a death
+    (columns), expanded from the pair table.
+    """
+    all_times, time_index = np.unique(sets.times, return_inverse=True)
+    shape = (len(sets.group_codes), len(all_times))
+    deaths = np.zeros(shape)
+    removed = np.zeros(shape)
+    np.add.at(deaths, (sets.group_of_pair, time_index), sets.observed)
+    np.add.at(removed, (sets.group_of_pair, time_index), sets.removed)
+    at_risk = sets.group_sizes[:, None] - (np.cumsum(removed, axis=1) - removed)
+
+    event_times = deaths.sum(axis=0) > 0
+    return deaths[:, event_times], at_risk[:, event_times]
+
+
+def _hypergeometric_factor(deaths, at_risk):
+    """d (n - d) / (n^2 (n - 1)) per time, zero where n <= 1"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = deaths * (at_risk - deaths) / (at_risk ** 2 * (at_risk - 1))
+    return np.where(at_risk > 1, factor, 0.0)
+
+
+def _logrank(sets):
+    labels = [sets.labels[code] for code in sets.group_codes]
+    result = {'groups': labels, 'test': None, 'pairwise': []}
+    if len(labels) < 2:
+        return result
+
+    D, N = _death_and_risk_matrices(sets)
+    d, n = D.sum(axis=0), N.sum(axis=0)
+
+    # k-group test: observed minus expected deaths and their covariance
+    expected = N * (d / n)
+    result['observed'] = dict(zip(labels, D.sum(axis=1).tolist()))
+    result['expected'] = dict(zip(labels, expected.sum(axis=1).tolist()))
+    z = (D - expected).sum(axis=1)
+    weighted = N * _hypergeometric_factor(d, n)
+    V = np.diag((weighted * n).sum(axis=1)) - weighted @ N.T
+    if not V[:-1, :-1].any():
+        # No deaths (or none with anyone else at risk): there is nothing to
+        # test, which is not the same as a statistic of 0 with p = 1
+        return result
+    statistic = float(z[:-1] @ np.linalg.pinv(V[:-1, :-1]) @ z[:-1])
+    df = len(labels) - 1
+    result['test'] = {'statistic': statistic, 'df': df, 'p_value': float(chi2.sf(statistic, df))}
+
+    # Pairwise two-group tests, each group against all later ones at once
+    for i in range(len(labels) - 1):
+        Dp, Np = D[i] + D[i + 1:], N[i] + N[i + 1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected_i = np.where(Np > 0, N[i] * Dp / Np, 0.0)
+        variance = (N[i] * N[i + 1:] * _hypergeometric_factor(Dp, Np)).sum(axis=1)
+        z_i = (D[i] - expected_i).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            statistics = np.where(variance > 0, z_i ** 2 / variance, 0.0)
+        for j, (pair_statistic, pair_variance) in enumerate(zip(statistics, variance), start=i + 1):
+            tested = pair_variance > 0
+            result['pairwise'].append({
+                'groups': [labels[i], labels[j]],
+                'statistic': float(pair_statistic) if tested else None,
+                'p_value': float(chi2.sf(pair_statistic, 1)) if tested else None,
+            })
+    return result
+
+
+def grouped_kaplan_meier(durations, events, groups=None):
+    """
+    Fit Kaplan-Meier curves for every group in one vectorized pass.
+
+    ``durations``, ``events`` and ``groups`` are equal-length array-likes.
+    Rows with a missing duration or group are ignored. Without ``groups`` a
+    single curve is returned under the key ``None``.
+
+    Returns a dict mapping each group label to a DataFrame with
+    ``CURVE_COLUMNS``.
+    """
+    sets = risk_sets(durations, events, groups)
+    return _curves(sets) if sets else {}
+
+
+def logrank(durations, events, groups):
+    """
+    Log-rank comparison of the groups: the k-group test across all of them
+    and a two-group test for every pair.
+
+    Returns a JSON-serializable dict with ``groups``, ``test`` (statistic,
+    df and p_value; None with fewer than two groups or no deaths to
+    compare), per-group ``observed`` and ``expected`` deaths, and
+    ``pairwise`` results (statistic and p_value None for a pair without
+    deaths to compare).
+    """
+    sets = risk_sets(durations, events, groups)
+    return _logrank(sets) if sets else {'groups': [], 'test': None, 'pairwise': []}
+
+
+def grouped_survival(durations, events, groups):
+    """Curves (``grouped_kaplan_meier``) and tests (``logrank``) from one risk-set table"""
+    sets = risk_sets(durations, events, groups)
+    if sets is None:
+        return {}, {'groups': [], 'test': None, 'pairwise': []}
+    return _curves(sets), _logrank(sets)
+
+
+def kaplan_meier(durations, events):
+    """Fit a single Kaplan-Meier curve (see ``grouped_kaplan_meier``)"""
+    return grouped_kaplan_meier(durations, events).get(None)
+
+
+def curves_by(df, key, duration_col='days_in_care', event_col='event'):
+    """Fit one curve per distinct value of the ``key`` column of ``df``"""
+    return grouped_kaplan_meier(df[duration_col], df[event_col], df[key])
+
+
+def curve_from_counts(times, observed, removed):
+    """
+    Build a curve from per-duration counts of a single group.
+
+    ``times`` must be sorted ascending; ``observed`` and ``removed`` hold the
+    deaths and total exits (deaths plus censored) at each time.
+    """
+    times = np.asarray(times, dtype=float)
+    observed = np.asarray(observed, dtype=np.int64)
+    removed = np.asarray(removed, dtype=np.int64)
+    if not len(times):
+        return None
+
+    total = removed.sum()
+    at_risk = total - (np.cumsum(removed) - removed)
+    survival = np.cumprod(1.0 - observed / at_risk)
+    with np.errstate(divide='ignore'):
+        terms = np.where(at_risk > observed, observed / (at_risk * (at_risk - observed)), 0.0)
+    ci_lower, ci_upper = _greenwood_bands(survival, np.cumsum(terms))
+
+    curve = pd.DataFrame({
+        'timeline': times,
+        'KM_estimate': survival,
+        'at_risk': at_risk,
+        'observed': observed,
+        'censored': removed - observed,
+        'ci_lower': ci_lower,
+        'ci_upper': ci_upper,
+    }, columns=CURVE_COLUMNS)
+    if times[0] > 0:
+        start = pd.DataFrame([[0.0, 1.0, total, 0, 0, 1.0, 1.0]], columns=CURVE_COLUMNS)
+        curve = pd.concat([start, curve], ignore_index=True)
+    return curve
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from survival_analysis.cache import bump_data_version
+from survival_analysis.models import PatientSurvival, SurvivalData
+
+
+class Command(BaseCommand):
+    help = "Fill the materialized duration, event and covariate columns of existing survival records"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # All or nothing: a failure part way leaves every column as it was
+        with transaction.atomic():
+            self.backfill(options['batch_size'])
+
+        # Queryset updates skip the signals, so drop cached curves explicitly
+        bump_data_version()
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    def backfill(self, batch_size):
+        updated = SurvivalData.objects.update(event=Case(
+            When(file_status=SurvivalData.EVENT_STATUS, then=Value(True)),
+            default=Value(False),
+        ))
+        self.stdout.write(f"SurvivalData: event set on {updated} records.")
+
+        # Date arithmetic differs per database and covariates need type
+        # checks, so durations and covariate columns are computed here
+        fields = ['duration', *PatientSurvival.COVARIATES]
+        batch = []
+        total = 0
+        records = PatientSurvival.objects.order_by('pk').only(
+            'pk', 'entry_date', 'last_followup', 'covariates'
+        ).iterator(chunk_size=batch_size)
+        for record in records:
+            record.duration = (record.last_followup - record.entry_date).days \
+                if record.entry_date and record.last_followup else None
+            record.sync_covariate_columns()
+            batch.append(record)
+            if len(batch) >= batch_size:
+                PatientSurvival.objects.bulk_update(batch, fields)
+                total += len(batch)
+                batch = []
+        if batch:
+            PatientSurvival.objects.bulk_update(batch, fields)
+            total += len(batch)
+        self.stdout.write(f"PatientSurvival: duration and covariate columns set on {total} records.")
@@ -0,0 +1,311 @@
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from importlib import import_module
+
+import django
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from openpyxl import Workbook
+
+from app1.decorators import admin_or_doctor_required, doctor_required, nurse_required
+from app1.factories import placeholder, required_fields
+from app1.models import PatientDemographics
+from survival_analysis import views
+from survival_analysis.cache import bump_data_version, reset_data_version
+from survival_analysis.models import PatientSurvival, SurvivalData
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+REFERRAL_PREFIX = 'BENCH'
+SEED_BATCH_SIZE = 5000
+
+DIAGNOSES = [
+    'Cancer', 'Heart Failure', 'COPD', 'Dementia',
+    'Renal Failure', 'Motor Neurone Disease', 'Liver Disease', 'Stroke',
+]
+
+
+class _QueryCounter:
+    """connection.execute_wrapper that counts the queries it sees"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def seed(size, rng):
+    """
+    Bulk-insert ``size`` synthetic patients, each with one ``SurvivalData``
+    and one ``PatientSurvival`` record.
+
+    bulk_create skips save(), so the materialized ``event``, ``duration``
+    and covariate columns are filled in here.
+    """
+    required = required_fields(PatientDemographics, exclude=['referral_number'])
+    try:
+        for field in required:
+            placeholder(field, 0)
+    except ValueError as exc:
+        raise CommandError(f"Can't seed PatientDemographics: {exc}")
+    registered_from = datetime.date(2018, 1, 1)
+
+    for start in range(0, size, SEED_BATCH_SIZE):
+        count = min(SEED_BATCH_SIZE, size - start)
+        patients = PatientDemographics.objects.bulk_create([
+            PatientDemographics(
+                referral_number=f'{REFERRAL_PREFIX}{index:07d}',
+                **{field.name: placeholder(field, index) for field in required}
+            )
+            for index in range(start, start + count)
+        ])
+
+        days = rng.exponential(60, count).astype(int)
+        died = rng.random(count) < 0.55
+        statuses = np.where(died, 'closed_died', rng.choice(
+            ['active', 'closed_recovered', 'closed_transferred', 'closed_lost'], count, p=[.6, .2, .15, .05]
+        ))
+        diagnoses = rng.choice(DIAGNOSES, count)
+        care_levels = rng.choice(['low', 'medium', 'high'], count)
+        places = rng.choice(['home', 'hospital', 'other'], count, p=[.6, .3, .1])
+        offsets = rng.integers(0, 6 * 365, count)
+
+        survival, patient_survival = [], []
+        for i, patient in enumerate(patients):
+            registered = registered_from + datetime.timedelta(days=int(offsets[i]))
+            ended = registered + datetime.timedelta(days=int(days[i]))
+            survival.append(SurvivalData(
+                patient=patient,
+                diagnosis=diagnoses[i],
+                days_in_care=int(days[i]),
+                pod=places[i] if died[i] else None,
+                dod=ended if died[i] else None,
+                date_case_registered=registered,
+                file_status=statuses[i],
+                level_of_care=care_levels[i],
+                event=bool(died[i]),
+            ))
+            record = PatientSurvival(
+                patient=patient,
+                entry_date=registered,
+                last_followup=ended,
+                event_occurred=bool(died[i]),
+                duration=int(days[i]),
+                covariates={
+                    'pain_level': int(rng.integers(0, 11)),
+                    'diagnosis_stage': int(rng.integers(1, 5)),
+                    'age': int(rng.integers(40, 96)),
+                },
+            )
+            record.sync_covariate_columns()
+            patient_survival.append(record)
+        SurvivalData.objects.bulk_create(survival, batch_size=SEED_BATCH_SIZE)
+        PatientSurvival.objects.bulk_create(patient_survival, batch_size=SEED_BATCH_SIZE)
+
+
+def import_workbook(rows, rng):
+    """An in-memory survival spreadsheet updating the first ``rows`` seeded patients"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(['Ref Number', 'Diagnosis', 'DaysInCare', 'Pod', 'Dod',
+               'DateCaseRegistered', 'FileStatus', 'Levelofcare'])
+    days = rng.exponential(60, rows).astype(int)
+    for index in range(rows):
+        ws.append([
+            f'{REFERRAL_PREFIX}{index:07d}', DIAGNOSES[index % len(DIAGNOSES)], int(days[index]),
+            'Home', '2024-06-01', '2024-01-01', 'Closed - Died', 'Medium Care',
+        ])
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def _consume(response):
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    response.close()
+    return response
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the survival analysis views and role decorators against synthetic data "
+        "and write wall time, query count and peak memory to a JSON report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                            help="Numbers of patients to seed, one benchmark round each")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Timed runs per path; the report keeps min, median and max")
+        parser.add_argument('--import-rows', type=int, default=100000,
+                            help="Upper bound on rows in the import spreadsheet")
+        parser.add_argument('--decorator-calls', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the synthetic data")
+        parser.add_argument('--output', help="Report path (default: survival-benchmark-<timestamp>.json)")
+        parser.add_argument('--allow-existing', action='store_true',
+                            help="Run even though survival data already exists (it will skew the results)")
+
+    def handle(self, *args, **options):
+        if not options['allow_existing'] and (SurvivalData.objects.exists() or PatientSurvival.objects.exists()):
+            raise CommandError(
+                "The database already has survival data. Benchmark against an empty database "
+                "or pass --allow-existing."
+            )
+
+        self.repeat = options['repeat']
+        self.factory = RequestFactory()
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'repeat': self.repeat,
+            'seed': options['seed'],
+            'results': [],
+        }
+
+        # Uploads and snapshots of the rolled-back data are written to a
+        # scratch directory, removed with it, rather than to the shared
+        # import and snapshot stores
+        with tempfile.TemporaryDirectory(prefix='survival-benchmark-') as scratch, override_settings(
+                SURVIVAL_IMPORT_ROOT=os.path.join(scratch, 'imports'),
+                SURVIVAL_SNAPSHOT_DIR=os.path.join(scratch, 'snapshot')):
+            for size in options['sizes']:
+                self.stdout.write(f"Benchmarking {size} patients...")
+                rng = np.random.default_rng(options['seed'])
+                # Everything seeded or imported in a round is rolled back afterwards
+                with transaction.atomic():
+                    started = time.perf_counter()
+                    seed(size, rng)
+                    bump_data_version()
+                    self.stdout.write(f"  seeded in {time.perf_counter() - started:.1f}s")
+
+                    for result in self.run_round(size, rng, options):
+                        result['size'] = size
+                        report['results'].append(result)
+                        self.stdout.write(
+                            f"  {result['path']:<32} {result['wall_time']['median']:.4f}s "
+                            f"{result['queries']:>6} queries {result['peak_memory'] / 2 ** 20:>9.1f} MiB"
+                        )
+                    transaction.set_rollback(True)
+                # The rollback undid the round's version bumps as well; move
+                # past them so results cached for the rolled-back data are dropped
+                reset_data_version()
+
+        output = options['output'] or f"survival-benchmark-{timezone.now():%Y%m%d-%H%M%S}.json"
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Report written to {output}"))
+
+    def run_round(self, size, rng, options):
+        user = self.benchmark_user()
+
+        yield self.measure('survival (cold)', lambda: views.survival(self.request(user)),
+                           before=bump_data_version)
+        yield self.measure('survival (warm)', lambda: views.survival(self.request(user)))
+        yield self.measure('predictive_analytics (cold)', lambda: views.predictive_analytics(self.request(user)),
+                           before=bump_data_version)
+        yield self.measure('predictive_analytics (warm)', lambda: views.predictive_analytics(self.request(user)))
+
+        rows = min(size, options['import_rows'])
+        workbook = import_workbook(rows, rng)
+
+        def run_import():
+            upload = SimpleUploadedFile('benchmark.xlsx', workbook)
+            request = self.request(user, 'post', {'survival_file': upload})
+            with override_settings(SURVIVAL_IMPORT_BACKGROUND=False):
+                return views.import_survival_data(request)
+
+        yield self.measure('import_survival_data', run_import, rows=rows)
+        yield self.measure('export_survival_data (csv)',
+                           lambda: _consume(views.export_survival_data(self.request(user, data={'format': 'csv'}))))
+        yield self.measure('export_survival_data (xlsx)',
+                           lambda: _consume(views.export_survival_data(self.request(user))),
+                           before=bump_data_version)
+
+        calls = options['decorator_calls']
+        for decorator in (doctor_required, nurse_required, admin_or_doctor_required):
+            view = decorator(lambda request: HttpResponse())
+            # One session shared by every call, like a logged-in browser
+            session = self.session()
+
+            def run_decorated():
+                for _ in range(calls):
+                    request = self.factory.get('/')
+                    request.user = user
+                    request.session = session
+                    view(request)
+
+            yield self.measure(f'{decorator.__name__} (x{calls})', run_decorated)
+
+    def measure(self, path, func, before=None, **extra):
+        """
+        Time ``func`` ``repeat`` times counting its queries, then run it once
+        more under tracemalloc for peak memory (kept out of the timed runs,
+        which it would slow down). ``before`` runs ahead of every call.
+        """
+        times = []
+        queries = 0
+        for _ in range(self.repeat):
+            if before:
+                before()
+            counter = _QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - started)
+            queries = counter.count
+
+        if before:
+            before()
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'path': path,
+            'wall_time': {'min': min(times), 'median': statistics.median(times), 'max': max(times)},
+            'queries': queries,
+            'peak_memory': peak,
+            **extra,
+        }
+
+    def benchmark_user(self):
+        user, _ = get_user_model().objects.get_or_create(
+            username='survival-benchmark', defaults={'is_staff': True}
+        )
+        group, _ = Group.objects.get_or_create(name='doctor')
+        user.groups.add(group)
+        return user
+
+    def session(self):
+        return import_module(settings.SESSION_ENGINE).SessionStore()
+
+    def request(self, user, method='get', data=None):
+        request = getattr(self.factory, method)('/', data or {})
+        request.user = user
+        request.session = self.session()
+        request._messages = FallbackStorage(request)
+        return request
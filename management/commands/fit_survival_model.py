@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from survival_analysis.risk import NotEnoughData, fit_risk_model
+
+
+class Command(BaseCommand):
+    help = "Fit the Cox proportional-hazards risk model used for individual predictions"
+
+    def handle(self, *args, **options):
+        try:
+            model = fit_risk_model()
+        except NotEnoughData as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f"Fitted risk model v{model.pk} on {model.n_records} records "
+            f"({model.n_events} deaths), concordance {model.concordance:.3f}."
+        )
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from survival_analysis.jobs import JOB_LEASE, resume_pending_jobs, stale_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Finish survival import jobs that were interrupted, continuing from their last checkpoint. "
+        "Jobs whose worker checked in within the lease are left alone."
+    )
+
+    def handle(self, *args, **options):
+        pending = stale_jobs().count()
+        if not pending:
+            self.stdout.write(f"No interrupted import jobs (jobs still alive within {JOB_LEASE} are skipped).")
+            return
+
+        self.stdout.write(f"Resuming {pending} import job(s)...")
+        resume_pending_jobs()
+        self.stdout.write(self.style.SUCCESS("Done."))
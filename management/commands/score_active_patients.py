@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from survival_analysis.risk import score_active_patients
+
+
+class Command(BaseCommand):
+    help = "Score every active patient with the current risk model and store the ranking"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        scored = score_active_patients()
+        if scored is None:
+            raise CommandError("No risk model has been fitted yet. Run fit_survival_model first.")
+
+        self.stdout.write(f"Scored {scored} active patients in {time.perf_counter() - started:.2f}s.")
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from app1.signals import sync_user_groups
+
+
+class Command(BaseCommand):
+    help = (
+        "Put users in the default groups for their role and staff/superuser flags, "
+        "e.g. after a bulk import that sent no post_save"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--role', help="Only sync users with this role")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk').only('pk', 'role', 'is_staff', 'is_superuser',
+                                                             'is_active', 'is_approved')
+        if options['role']:
+            users = users.filter(role=options['role'])
+
+        changed = 0
+        batch = []
+        for user in users.iterator(chunk_size=options['batch_size']):
+            batch.append(user)
+            if len(batch) >= options['batch_size']:
+                changed += sync_user_groups(batch)
+                batch = []
+        changed += sync_user_groups(batch)
+        self.stdout.write(self.style.SUCCESS(f"Groups changed for {changed} users."))
@@ -1,44 +1,80 @@
-from django.shortcuts import redirect
+import re
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+
+# Paths that never require login
+AUTH_PATHS = ['/login/', '/logout/', '/register/', '/unauthorized/']
+
+
+def _prefix_regex(prefixes):
+    """One anchored regex matching any of the given path prefixes"""
+    prefixes = [prefix for prefix in prefixes if prefix]
+    if not prefixes:
+        return None
+    return re.compile('|'.join(re.escape(prefix) for prefix in sorted(prefixes, key=len, reverse=True)))
 
 
 class AuthMiddleware:
+    """
+    Redirect anonymous users to the login page.
+
+    The check runs in ``process_view``, after URL resolution, so an unknown
+    URL still gets its 404. The auth pages, static files and
+    AUTH_EXEMPT_PATHS are exempt by prefix, compiled once into a regex and
+    checked before the session or user is touched; views marked
+    ``login_exempt`` are exempt wherever they are routed. Works as both sync
+    and async middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Django adapts process_view to the handler's mode; hand it the
+            # coroutine so the check doesn't hop to a thread
+            self.process_view = self.aprocess_view
+
+        # Assets and health checks: never load the session or user. Uploaded
+        # media is patient data and stays behind the login.
+        self.passthrough = _prefix_regex([
+            settings.STATIC_URL and '/' + settings.STATIC_URL.lstrip('/'),
+            *getattr(settings, 'AUTH_EXEMPT_PATHS', []),
+        ] + AUTH_PATHS)
 
     def __call__(self, request):
-        # Skip middleware for auth-related paths
-        auth_paths = ['/login/', '/logout/', '/register/', '/unauthorized/']
-        if any(request.path.startswith(path) for path in auth_paths):
-            return self.get_response(request)
+        if self.is_async:
+            return self.__acall__(request)
+        return self.get_response(request)
 
-        response = self.get_response(request)
-        return response
+    async def __acall__(self, request):
+        return await self.get_response(request)
 
-    def process_view(self, request, view_func, view_args, view_kwargs):
-        # Skip middleware for these views
+    def _is_exempt(self, request, view_func):
         if getattr(view_func, 'login_exempt', False):
+            return True
+        return bool(self.passthrough and self.passthrough.match(request.path_info))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Skip middleware for exempt paths and views
+        if self._is_exempt(request, view_func):
             return None
 
         if not request.user.is_authenticated:
-            return redirect(f'/login/?next={request.path}')
+            return redirect_to_login(request.get_full_path())
 
         return None
 
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if self._is_exempt(request, view_func):
+            return None
 
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        return None
@@ -1,7 +1,39 @@
+import math
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from django.db import models
+from django.db.models import Case, Value, When
+from django.db.models.expressions import Combinable
+from django.db.models.lookups import Exact
 from app1.models import PatientDemographics
 
+
+def covariate_value(value, kind):
+    """``value`` from the covariates JSON as ``kind`` (int or float), or None if it isn't one"""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        converted = kind(value)
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if not math.isfinite(number) or (kind is int and converted != number):
+        return None
+    return converted
+
+
 class PatientSurvival(models.Model):
+    # Covariate registry: known keys of the covariates JSON and their types.
+    # Each is projected into the indexed column of the same name on save, so
+    # cohort filters and model training read typed columns instead of JSON.
+    COVARIATES = {
+        'pain_level': int,       # 0-10
+        'diagnosis_stage': int,  # 1-4
+    }
+
     patient = models.OneToOneField(
         PatientDemographics,
         on_delete=models.CASCADE,
@@ -17,10 +49,61 @@ class PatientSurvival(models.Model):
         blank=True,
         help_text="Additional risk factors (e.g., {'pain_level': 4, 'diagnosis_stage': 3})"
     )
+    duration = models.IntegerField(
+        blank=True, null=True, editable=False, db_index=True,
+        help_text="Days from entry_date to last_followup, kept in sync on save"
+    )
+    pain_level = models.SmallIntegerField(
+        blank=True, null=True, editable=False, db_index=True,
+        help_text="covariates['pain_level'], kept in sync on save"
+    )
+    diagnosis_stage = models.SmallIntegerField(
+        blank=True, null=True, editable=False, db_index=True,
+        help_text="covariates['diagnosis_stage'], kept in sync on save"
+    )
+
+    def sync_covariate_columns(self):
+        """Project the registered covariates from the JSON onto their columns"""
+        covariates = self.covariates if isinstance(self.covariates, dict) else {}
+        for key, kind in self.COVARIATES.items():
+            setattr(self, key, covariate_value(covariates.get(key), kind))
+
+    def save(self, *args, **kwargs):
+        self.duration = (self.last_followup - self.entry_date).days \
+            if self.entry_date and self.last_followup else None
+        self.sync_covariate_columns()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            derived = set()
+            if {'entry_date', 'last_followup'} & set(update_fields):
+                derived.add('duration')
+            if 'covariates' in update_fields:
+                derived.update(self.COVARIATES)
+            kwargs['update_fields'] = set(update_fields) | derived
+        super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = "Survival Analysis Record"
 
+class SurvivalDataQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        Keep ``event`` in sync when ``file_status`` is set in bulk, as save()
+        does for single records. Covers bulk_update() too, which goes
+        through update().
+        """
+        if 'file_status' in kwargs and 'event' not in kwargs:
+            status = kwargs['file_status']
+            if isinstance(status, Combinable):
+                kwargs['event'] = Case(
+                    When(Exact(status, Value(self.model.EVENT_STATUS)), then=Value(True)),
+                    default=Value(False),
+                )
+            else:
+                kwargs['event'] = status == self.model.EVENT_STATUS
+        return super().update(**kwargs)
+
+
 class SurvivalData(models.Model):
     POD_CHOICES = [
         ('home', 'Home'),
@@ -42,6 +125,16 @@ class SurvivalData(models.Model):
         ('high', 'High Care'),
     ]
 
+    # file_status that counts as the event (death) in survival curves
+    EVENT_STATUS = 'closed_died'
+
+    # Fields survival curves can be grouped by, with their display titles
+    CURVE_GROUPINGS = {
+        'diagnosis': 'Diagnosis',
+        'level_of_care': 'Level of Care',
+        'pod': 'Place of Death',
+    }
+
     patient = models.ForeignKey(PatientDemographics, on_delete=models.CASCADE, related_name='survival_data')
     diagnosis = models.CharField(max_length=200)
     days_in_care = models.PositiveIntegerField(blank=True, null=True)
@@ -51,10 +144,156 @@ class SurvivalData(models.Model):
     file_status = models.CharField(max_length=50, choices=STATUS_CHOICES)
     level_of_care = models.CharField(max_length=20, choices=CARE_LEVEL_CHOICES, blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
+    event = models.BooleanField(
+        default=False, editable=False,
+        help_text="True if file_status is the death event, kept in sync on save and queryset updates"
+    )
+
+    objects = SurvivalDataQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.patient} - {self.diagnosis} ({self.file_status})"
 
+    def save(self, *args, **kwargs):
+        self.event = self.file_status == self.EVENT_STATUS
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'file_status' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'event'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Survival Data"
         verbose_name_plural = "Survival Data"
+        # days_in_care is the duration; these let curve queries read
+        # narrow, pre-sorted index ranges per group
+        indexes = [
+            models.Index(fields=['diagnosis', 'days_in_care'], name='survival_diagnosis_days_idx'),
+            models.Index(fields=['level_of_care', 'days_in_care'], name='survival_care_days_idx'),
+        ]
+
+
+class SurvivalImportStorage(FileSystemStorage):
+    """
+    Storage for uploaded import spreadsheets, which hold patient data: under
+    SURVIVAL_IMPORT_ROOT, outside MEDIA_ROOT, so they are never served.
+    """
+
+    @property
+    def base_location(self):
+        path = getattr(settings, 'SURVIVAL_IMPORT_ROOT', None)
+        return Path(path) if path else Path(settings.BASE_DIR) / 'var' / 'survival_imports'
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+class SurvivalImportJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    # Deleted by the worker once the job completes or fails
+    file = models.FileField(upload_to='survival_imports/', storage=SurvivalImportStorage())
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    last_chunk = models.IntegerField(
+        default=-1,
+        help_text="Index of the last chunk committed; a resumed job continues after it"
+    )
+    errors = models.JSONField(default=list, blank=True)
+    error_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Rows rejected in total; only the first of them are kept in errors"
+    )
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(
+        blank=True, null=True,
+        help_text="Last sign of life from the worker running the job; a job is only resumed once it goes stale"
+    )
+
+    def __str__(self):
+        return f"Import #{self.pk} ({self.status})"
+
+    @property
+    def progress(self):
+        if not self.total_rows:
+            return 100 if self.status == 'completed' else 0
+        return round(100 * self.processed_rows / self.total_rows)
+
+    class Meta:
+        verbose_name = "Survival Import Job"
+        ordering = ['-created_at']
+
+
+class SurvivalRiskModel(models.Model):
+    """
+    A fitted Cox proportional-hazards model (see ``risk.py``).
+
+    ``artifact`` holds everything needed to score a patient (feature layout,
+    coefficients, centring means and the baseline survival curve), so
+    predictions never refit. The newest row is the one in use; its pk is
+    the model version.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    n_records = models.PositiveIntegerField()
+    n_events = models.PositiveIntegerField()
+    concordance = models.FloatField(blank=True, null=True)
+    artifact = models.JSONField()
+
+    def __str__(self):
+        return f"Risk model v{self.pk} ({self.n_records} records)"
+
+    class Meta:
+        verbose_name = "Survival Risk Model"
+        ordering = ['-pk']
+
+
+class RiskScore(models.Model):
+    """
+    Latest batch risk score of an active patient (see ``risk.score_active_patients``),
+    from the patient's riskiest active record.
+
+    Rewritten wholesale on every scoring run; the ranking page reads it in
+    ``-risk`` order straight off the index.
+    """
+    survival_data = models.OneToOneField(SurvivalData, on_delete=models.CASCADE, related_name='risk_score')
+    patient = models.ForeignKey(PatientDemographics, on_delete=models.CASCADE, related_name='risk_scores')
+    model = models.ForeignKey(SurvivalRiskModel, on_delete=models.CASCADE, related_name='scores')
+    risk = models.FloatField(help_text="Probability of death within the risk horizon")
+    hazard_ratio = models.FloatField()
+    scored_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.patient} - {self.risk:.1%}"
+
+    class Meta:
+        verbose_name = "Risk Score"
+        indexes = [
+            models.Index(fields=['-risk'], name='risk_score_rank_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['patient'], name='risk_score_one_per_patient'),
+        ]
+
+
+class SurvivalDataVersion(models.Model):
+    """
+    The survival data version stamp (see ``cache.py``), kept in a single row.
+
+    It is bumped with ``UPDATE ... SET value = value + 1``, which the database
+    applies atomically, so two commits never get the same version.
+    """
+    value = models.BigIntegerField()
+
+    class Meta:
+        verbose_name = "Survival Data Version"
@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import PatientSurvival, SurvivalData, SurvivalRiskModel
+from .risk import forget_model_version
+from .snapshot import record_change
+
+
+@receiver(pre_save, sender=SurvivalData)
+def remember_previous_patient(sender, instance, **kwargs):
+    """Keep the stored patient, whose rows also change if the record is moved to another"""
+    instance._survival_previous_patient = None
+    if instance.pk is not None and not kwargs.get('raw'):
+        instance._survival_previous_patient = (
+            SurvivalData.objects.filter(pk=instance.pk).values_list('patient_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=SurvivalData)
+def record_saved_survival_data(sender, instance, **kwargs):
+    """Log the patients whose rows changed and invalidate cached results"""
+    patients = {instance.patient_id}
+    previous = getattr(instance, '_survival_previous_patient', None)
+    if previous is not None:
+        patients.add(previous)
+    transaction.on_commit(lambda: record_change(patients))
+
+
+@receiver(post_delete, sender=SurvivalData)
+@receiver(post_save, sender=PatientSurvival)
+@receiver(post_delete, sender=PatientSurvival)
+def record_survival_change(sender, instance, **kwargs):
+    """Bump the data version so snapshots, counts and cached curves move on"""
+    transaction.on_commit(lambda: record_change([instance.patient_id]))
+
+
+@receiver(post_save, sender=SurvivalRiskModel)
+@receiver(post_delete, sender=SurvivalRiskModel)
+def refresh_risk_model_version(sender, **kwargs):
+    """Make every process pick up the newest risk model on its next prediction"""
+    transaction.on_commit(forget_model_version)
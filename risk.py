@@ -0,0 +1,295 @@
+"""
+Cox proportional-hazards risk model for individual patient predictions.
+
+``fit_risk_model()`` fits lifelines' ``CoxPHFitter`` offline on
+``SurvivalData`` (duration and event) joined with the registered
+``PatientSurvival.COVARIATES``, read from the columnar snapshot, and stores the result as a compact
+``SurvivalRiskModel`` artifact. Requests never fit: ``get_risk_model()``
+loads the current artifact once per process, and scoring is a dot product
+against the coefficients plus a lookup in the baseline survival curve.
+
+``score_active_patients()`` scores every active patient in one vectorized
+pass and stores the results as ``RiskScore`` rows for the ranking page, one
+per patient.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import KEY_PREFIX
+from .snapshot import get_snapshot
+from .models import PatientSurvival, RiskScore, SurvivalData, SurvivalRiskModel
+
+ARTIFACT_FORMAT = 1
+CURRENT_MODEL_KEY = f'{KEY_PREFIX}:risk_model_version'
+
+# Mortality horizons (days) reported for a patient; the first is the headline risk score
+RISK_HORIZONS = (90, 30, 180)
+
+# A registered covariate becomes a model feature if at least this share of records have it
+MIN_COVARIATE_COVERAGE = 0.5
+# Diagnoses with fewer records than this are pooled into the reference category
+MIN_CATEGORY_RECORDS = 30
+# Ridge penalty; keeps sparse one-hot columns from diverging
+PENALIZER = 0.01
+
+CATEGORICAL_FEATURES = ('diagnosis', 'level_of_care')
+
+
+class NotEnoughData(Exception):
+    pass
+
+
+def _category_column(field, value):
+    return f'{field}={value}'
+
+
+def _covariate_lookups(prefix=''):
+    return [f'{prefix}{key}' for key in PatientSurvival.COVARIATES]
+
+
+def training_frame():
+    """One row per survival record: duration, event, categories and covariates, from the snapshot"""
+    snapshot = get_snapshot()
+    return pd.DataFrame({
+        'duration': snapshot.durations,
+        'event': snapshot.events,
+        **{field: snapshot.labels(field) for field in CATEGORICAL_FEATURES},
+        **{key: snapshot[key] for key in PatientSurvival.COVARIATES},
+    })
+
+
+class CoxRiskModel:
+    """A loaded risk model artifact, scored with NumPy only"""
+
+    def __init__(self, artifact, version=None):
+        if artifact.get('format') != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported risk model artifact format: {artifact.get('format')}")
+        self.version = version
+        self.features = artifact['features']
+        self.covariates = artifact['covariates']
+        self.fill = artifact['fill']
+        self.coefficients = np.asarray(artifact['coefficients'], dtype=float)
+        self.means = np.asarray(artifact['means'], dtype=float)
+        self.timeline = np.asarray(artifact['baseline']['timeline'], dtype=float)
+        self.baseline_survival = np.asarray(artifact['baseline']['survival'], dtype=float)
+        self.concordance = artifact.get('concordance')
+        self._columns = {name: i for i, name in enumerate(self.features)}
+
+    def feature_matrix(self, diagnoses, levels_of_care, covariates):
+        """
+        Model inputs for many patients at once, one row per patient.
+
+        ``covariates`` maps covariate keys to per-patient value sequences;
+        missing values take the training mean and unknown categories fall to
+        the reference level.
+        """
+        X = np.zeros((len(diagnoses), len(self.features)))
+        for field, values in zip(CATEGORICAL_FEATURES, (diagnoses, levels_of_care)):
+            columns = pd.Series(values, dtype=object).map(
+                lambda value: self._columns.get(_category_column(field, value), -1)
+            ).to_numpy(dtype=int)
+            rows = np.flatnonzero(columns >= 0)
+            X[rows, columns[rows]] = 1.0
+        for key in self.covariates:
+            # Covariate columns hold ints or NULL, which becomes NaN here
+            values = np.array(covariates.get(key, [None] * len(X)), dtype=float)
+            X[:, self._columns[key]] = np.where(np.isnan(values), self.fill[key], values)
+        return X
+
+    def feature_vector(self, diagnosis=None, level_of_care=None, covariates=None):
+        """Model input for one patient; ``covariates`` maps keys to single values"""
+        x = np.zeros(len(self.features))
+        for field, value in zip(CATEGORICAL_FEATURES, (diagnosis, level_of_care)):
+            column = self._columns.get(_category_column(field, value))
+            if column is not None:
+                x[column] = 1.0
+        covariates = covariates or {}
+        for key in self.covariates:
+            value = covariates.get(key)
+            x[self._columns[key]] = self.fill[key] if value is None or np.isnan(value) else value
+        return x
+
+    def partial_hazard(self, x):
+        """Hazard relative to the average training patient"""
+        return np.exp((np.asarray(x) - self.means) @ self.coefficients)
+
+    def baseline_at(self, days):
+        """Baseline survival S0(t), a step function of the fitted timeline"""
+        index = np.searchsorted(self.timeline, days, side='right') - 1
+        return np.where(index >= 0, self.baseline_survival[np.maximum(index, 0)], 1.0)
+
+    def survival_at(self, x, days):
+        return self.baseline_at(days) ** self.partial_hazard(x)
+
+    def median_survival(self, x):
+        """First day the predicted survival drops to 50%, or None if it never does"""
+        below = self.baseline_survival ** self.partial_hazard(x) <= 0.5
+        return float(self.timeline[np.argmax(below)]) if below.any() else None
+
+    def predict(self, diagnosis=None, level_of_care=None, covariates=None):
+        x = self.feature_vector(diagnosis, level_of_care, covariates)
+        survival = self.survival_at(x, np.asarray(RISK_HORIZONS, dtype=float))
+        return {
+            'risk': float(1 - survival[0]),
+            'horizons': {days: float(1 - s) for days, s in zip(RISK_HORIZONS, survival)},
+            'hazard_ratio': float(self.partial_hazard(x)),
+            'median_survival': self.median_survival(x),
+        }
+
+
+def build_artifact(frame):
+    """Fit a Cox model on a ``training_frame()`` and return its artifact dict"""
+    from lifelines import CoxPHFitter
+
+    if len(frame) < 2 or not frame['event'].any():
+        raise NotEnoughData("Need at least two survival records and one death to fit a risk model.")
+
+    design = pd.DataFrame(index=frame.index)
+    for field in CATEGORICAL_FEATURES:
+        counts = frame[field].fillna('').value_counts()
+        # The most common level is the reference; rare levels are pooled into it
+        for value in counts.index[1:][(counts.iloc[1:] >= MIN_CATEGORY_RECORDS).to_numpy()]:
+            design[_category_column(field, value)] = (frame[field].fillna('') == value).astype(float)
+
+    # Registered covariates present in enough records; missing values take the mean
+    fill = {}
+    for key in PatientSurvival.COVARIATES:
+        values = pd.to_numeric(frame[key], errors='coerce').astype(float)
+        if values.notna().mean() >= MIN_COVARIATE_COVERAGE:
+            fill[key] = float(values.mean())
+            design[key] = values.fillna(fill[key])
+
+    # Constant columns carry no information and break the fit
+    design = design.loc[:, design.nunique() > 1]
+    features = list(design.columns)
+    design['duration'] = frame['duration'].astype(float)
+    design['event'] = frame['event'].astype(bool)
+
+    cph = CoxPHFitter(penalizer=PENALIZER)
+    cph.fit(design, duration_col='duration', event_col='event')
+
+    baseline = cph.baseline_survival_.iloc[:, 0]
+    return {
+        'format': ARTIFACT_FORMAT,
+        'features': features,
+        'covariates': [key for key in fill if key in features],
+        'fill': fill,
+        'coefficients': [float(cph.params_[name]) for name in features],
+        # lifelines centres covariates on their training means before fitting
+        'means': [float(design[name].mean()) for name in features],
+        'baseline': {
+            'timeline': [float(t) for t in baseline.index],
+            'survival': [float(s) for s in baseline.values],
+        },
+        'concordance': float(cph.concordance_index_),
+    }
+
+
+def fit_risk_model():
+    """Fit on the current data, store it as the newest ``SurvivalRiskModel`` and return it"""
+    frame = training_frame()
+    artifact = build_artifact(frame)
+    model = SurvivalRiskModel.objects.create(
+        n_records=len(frame),
+        n_events=int(frame['event'].sum()),
+        concordance=artifact['concordance'],
+        artifact=artifact,
+    )
+    cache.set(CURRENT_MODEL_KEY, model.pk, None)
+    return model
+
+
+def current_model_version():
+    """pk of the risk model in use, or None if none has been fitted"""
+    version = cache.get(CURRENT_MODEL_KEY)
+    if version is None:
+        version = SurvivalRiskModel.objects.values_list('pk', flat=True).first() or 0
+        cache.set(CURRENT_MODEL_KEY, version, None)
+    return version or None
+
+
+def forget_model_version():
+    cache.delete(CURRENT_MODEL_KEY)
+
+
+def _stored_model(version):
+    """``(version, artifact)`` of model ``version``, else of the newest stored model, else None"""
+    row = SurvivalRiskModel.objects.filter(pk=version).values_list('pk', 'artifact').first()
+    if row is None:
+        # Deleted after its version was cached; fall back to the newest model
+        row = SurvivalRiskModel.objects.values_list('pk', 'artifact').first()
+        cache.set(CURRENT_MODEL_KEY, row[0] if row else 0, None)
+    return row
+
+
+_loaded = None
+_load_lock = threading.Lock()
+
+
+def get_risk_model():
+    """
+    The current ``CoxRiskModel``, or None if no model has been fitted.
+
+    The artifact is loaded once per process and reused until a newer model
+    version is stored; checking the version is a single cache read. If the
+    model in use has been deleted, the newest remaining one takes over.
+    """
+    global _loaded
+    version = current_model_version()
+    if version is None:
+        return None
+    loaded = _loaded
+    if loaded is None or loaded.version != version:
+        with _load_lock:
+            if _loaded is None or _loaded.version != version:
+                row = _stored_model(version)
+                if row is None:
+                    return None
+                _loaded = CoxRiskModel(row[1], row[0])
+            loaded = _loaded
+    return loaded
+
+
+def score_active_patients(model=None, batch_size=2000):
+    """
+    Score every active patient with ``model`` (default: the current one) and
+    replace the stored ``RiskScore`` rows. Returns the number of patients
+    scored, or None if there is no fitted model.
+
+    One joined query reads every active record with its covariate columns;
+    the whole batch is then scored as a single feature matrix. A patient
+    with several active records is ranked by the riskiest of them.
+    """
+    model = model or get_risk_model()
+    if model is None:
+        return None
+
+    rows = list(SurvivalData.objects.filter(file_status='active').values_list(
+        'pk', 'patient_id', 'diagnosis', 'level_of_care',
+        *_covariate_lookups('patient__patient_survival_record__')
+    ))
+    scored_at = timezone.now()
+    scores = []
+    if rows:
+        pks, patient_ids, diagnoses, levels_of_care, *columns = zip(*rows)
+        covariates = dict(zip(PatientSurvival.COVARIATES, columns))
+        hazard_ratios = model.partial_hazard(model.feature_matrix(diagnoses, levels_of_care, covariates))
+        risks = 1 - model.baseline_at(RISK_HORIZONS[0]) ** hazard_ratios
+        # Riskiest record first, then the first record of each patient
+        order = np.argsort(-risks, kind='stable')
+        _, first = np.unique(np.asarray(patient_ids)[order], return_index=True)
+        scores = [
+            RiskScore(survival_data_id=pks[i], patient_id=patient_ids[i], model_id=model.version,
+                      risk=float(risks[i]), hazard_ratio=float(hazard_ratios[i]), scored_at=scored_at)
+            for i in order[np.sort(first)]
+        ]
+
+    with transaction.atomic():
+        RiskScore.objects.all().delete()
+        RiskScore.objects.bulk_create(scores, batch_size=batch_size)
+    return len(scores)
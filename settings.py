@@ -51,6 +51,29 @@ if 'DATABASE_URL' in os.environ:
         conn_health_checks=True,
     )
 
+# Shared cache (required). Survival results and permission snapshots are
+# read by every worker process, so a per-process backend such as LocMemCache
+# serves stale data; the survival_analysis.W001 system check warns about one.
+# Uses Redis when REDIS_URL is set, otherwise the database cache table
+# (`python manage.py createcachetable`), which has no atomic add, so
+# survival_analysis.W002 recommends Redis in production.
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+            # Culling evicts results and snapshot change logs early; keep room for them
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
 # Security settings
 SESSION_COOKIE_SECURE = not DEBUG  # True in production
 CSRF_COOKIE_SECURE = not DEBUG    # True in production
@@ -90,6 +113,8 @@ LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'  # For staff users
 STAFF_LOGIN_REDIRECT_URL = '/login/' # for staff
 ADMIN_LOGIN_REDIRECT_URL = '/admin/'  # For superusers
+# Extra path prefixes app1.middleware.AuthMiddleware lets through without login (e.g. health checks)
+AUTH_EXEMPT_PATHS = []
 
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
@@ -392,6 +417,23 @@ SITE_ID = 1
 
 IMPORT_EXPORT_USE_TRANSACTIONS = True
 
+# Survival spreadsheet imports run on a local worker pool ('thread' or 'process')
+SURVIVAL_IMPORT_BACKGROUND = True
+SURVIVAL_IMPORT_EXECUTOR = os.environ.get('SURVIVAL_IMPORT_EXECUTOR', 'thread')
+SURVIVAL_IMPORT_WORKERS = int(os.environ.get('SURVIVAL_IMPORT_WORKERS', 2))
+SURVIVAL_IMPORT_CHUNK_ROWS = 5000
+# Uploaded import spreadsheets hold patient data: they are kept here, outside
+# MEDIA_ROOT, only until their import job completes or fails
+SURVIVAL_IMPORT_ROOT = os.environ.get('SURVIVAL_IMPORT_ROOT', BASE_DIR / 'var' / 'survival_imports')
+
+# Serve survival analytics with async views (for ASGI deployments); building
+# the page contexts then runs in a process pool of this many workers
+SURVIVAL_ASYNC_VIEWS = os.environ.get('SURVIVAL_ASYNC_VIEWS', 'False') == 'True'
+SURVIVAL_COMPUTE_WORKERS = int(os.environ.get('SURVIVAL_COMPUTE_WORKERS', 2))
+
+# Memory-mapped columnar snapshots of the survival dataset (see survival_analysis/snapshot.py)
+SURVIVAL_SNAPSHOT_DIR = os.environ.get('SURVIVAL_SNAPSHOT_DIR', BASE_DIR / 'var' / 'survival_snapshot')
+
 DYNAMIC_DATATB = {
     'forms' : "app1.models.UserForm",
     'formsub':"app1.models.FormSubmission",
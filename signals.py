@@ -1,9 +1,15 @@
-from django.db.models.signals import post_save, post_migrate
+import operator
+import threading
+from functools import reduce
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, post_migrate, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import Group, Permission
-from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
-from .models import User, RegistrationToken
+from .models import User, RegistrationToken, UserProfile
+from .authz import global_version, invalidate_user, invalidate_all
 
 # Default groups with their permissions
 GROUP_PERMISSIONS = {
@@ -29,66 +35,235 @@ GROUP_PERMISSIONS = {
     ]
 }
 
+# App whose models the default permissions belong to
+PERMISSIONS_APP_LABEL = 'app1'
+
 @receiver(post_migrate)
-def create_default_groups_and_permissions(sender, **kwargs):
-    """Create default groups and assign permissions when database is ready"""
+def create_default_groups_and_permissions(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Create default groups and assign permissions when database is ready.
+
+    post_migrate is sent once per installed app; this only runs for the app
+    that owns the permissions, after its own permissions have been created.
+    Existing groups get any missing permissions reconciled, so it is safe to
+    run on every migrate.
+    """
+    if sender.label != PERMISSIONS_APP_LABEL:
+        return
+
     # Create groups
-    for group_name in GROUP_PERMISSIONS.keys():
-        group, created = Group.objects.get_or_create(name=group_name)
-        if created:
-            # Assign permissions to the group
-            for perm_codename in GROUP_PERMISSIONS[group_name]:
-                try:
-                    # Split permission codename to get app_label and model
-                    action, model_name = perm_codename.split('_', 1)
-                    # Get the content type
-                    ct = ContentType.objects.get(app_label='app1', model=model_name)
-                    # Get the permission
-                    perm = Permission.objects.get(content_type=ct, codename=perm_codename)
-                    group.permissions.add(perm)
-                except (ContentType.DoesNotExist, Permission.DoesNotExist):
-                    continue
+    groups = dict(Group.objects.using(using).filter(
+        name__in=GROUP_PERMISSIONS.keys()).values_list('name', 'id'))
+    existing_groups = set(groups.values())
+    missing_groups = [Group(name=name) for name in GROUP_PERMISSIONS if name not in groups]
+    if missing_groups:
+        Group.objects.using(using).bulk_create(missing_groups, ignore_conflicts=True)
+        forget_group_ids()
+        groups = dict(Group.objects.using(using).filter(
+            name__in=GROUP_PERMISSIONS.keys()).values_list('name', 'id'))
+
+    # Resolve every codename with a single query
+    codenames = {codename for perms in GROUP_PERMISSIONS.values() for codename in perms}
+    permission_ids = {}
+    for perm_id, codename in Permission.objects.using(using).filter(
+            content_type__app_label=PERMISSIONS_APP_LABEL, codename__in=codenames
+    ).values_list('id', 'codename'):
+        permission_ids.setdefault(codename, []).append(perm_id)
+
+    # Assign permissions to the groups, inserting only the missing links
+    through = Group.permissions.through
+    existing = set(through.objects.using(using).filter(
+        group_id__in=groups.values()).values_list('group_id', 'permission_id'))
+    links = [
+        through(group_id=groups[group_name], permission_id=perm_id)
+        for group_name, perm_codenames in GROUP_PERMISSIONS.items()
+        for codename in perm_codenames
+        for perm_id in permission_ids.get(codename, ())
+        if (groups[group_name], perm_id) not in existing
+    ]
+    if links:
+        through.objects.using(using).bulk_create(links, ignore_conflicts=True)
+        # Through-model inserts send no m2m_changed. Nobody holds a snapshot of
+        # a group created just now, and on a fresh database the cache table
+        # (createcachetable) may not exist yet, so only existing groups count.
+        if any(link.group_id in existing_groups for link in links):
+            invalidate_all()
+
+# Group names a user is put in, by role (anything else counts as staff)
+ROLE_GROUPS = {
+    'doctor': 'Doctors',
+    'nurse': 'Nurses',
+    'admin': 'Administrators',
+}
+GROUP_SYNC_FIELDS = ('role', 'is_staff', 'is_superuser')
+
+# Users whose groups are being synced right now, to ignore re-entrant saves
+_syncing = threading.local()
+
+# Default group ids, cached in-process. Group saves and deletes in this
+# process forget them; those in other processes replace the global
+# authorization stamp they were read under.
+_group_ids = {'version': None, 'ids': None}
+
+
+def get_group_ids():
+    """Ids of the default groups, creating any that are missing"""
+    version = global_version()
+    cached = _group_ids.copy()
+    if cached['ids'] is not None and cached['version'] == version:
+        return cached['ids']
+
+    group_ids = dict(Group.objects.filter(
+        name__in=GROUP_PERMISSIONS.keys()).values_list('name', 'id'))
+    for name in GROUP_PERMISSIONS:
+        if name not in group_ids:
+            group, _ = Group.objects.get_or_create(name=name)
+            group_ids[name] = group.pk
+    _group_ids.update(version=version, ids=group_ids)
+    return group_ids
+
+
+def forget_group_ids():
+    _group_ids.update(version=None, ids=None)
+
+
+def desired_group_ids(user, group_ids=None):
+    """The exact set of group ids a user should belong to"""
+    group_ids = group_ids or get_group_ids()
+    names = set()
+    if user.is_staff:
+        names.add('Staff')
+    if user.is_superuser:
+        names.add('Administrators')
+    names.add(ROLE_GROUPS.get(user.role, 'Staff'))
+    return {group_ids[name] for name in names}
+
+
+def approve_superuser(user):
+    """Auto-approve and activate a superuser with an UPDATE, which sends no post_save"""
+    if not user.is_superuser or (user.is_active and user.is_approved):
+        return
+    now = timezone.now()
+    User.objects.filter(pk=user.pk).update(
+        is_active=True, is_approved=True, approved_by=user, approved_at=now
+    )
+    user.is_active = True
+    user.is_approved = True
+    user.approved_by = user
+    user.approved_at = now
+
+
+def sync_user_groups(users):
+    """
+    Bulk variant of the post_save group sync, for admin actions and imports
+    (bulk_create and queryset updates send no post_save). Reads the current
+    memberships of all ``users`` in one query, then removes and adds only the
+    differences with one delete and one bulk insert. Returns the number of
+    users whose groups changed.
+    """
+    users = [user for user in users if user.pk is not None]
+    if not users:
+        return 0
+    for user in users:
+        approve_superuser(user)
+
+    through = User.groups.through
+    current = {}
+    for user_id, group_id in through.objects.filter(
+            user_id__in=[user.pk for user in users]).values_list('user_id', 'group_id'):
+        current.setdefault(user_id, set()).add(group_id)
+
+    group_ids = get_group_ids()
+    stale, missing, changed = [], [], set()
+    for user in users:
+        desired = desired_group_ids(user, group_ids)
+        have = current.get(user.pk, set())
+        if have - desired:
+            stale.append(Q(user_id=user.pk, group_id__in=have - desired))
+        missing += [through(user_id=user.pk, group_id=group_id) for group_id in desired - have]
+        if have != desired:
+            changed.add(user.pk)
+
+    with transaction.atomic():
+        if stale:
+            through.objects.filter(reduce(operator.or_, stale)).delete()
+        if missing:
+            through.objects.bulk_create(missing, ignore_conflicts=True)
+    # Through-model writes send no m2m_changed
+    for user_id in changed:
+        invalidate_user(user_id)
+    return len(changed)
+
 
 @receiver(post_save, sender=User)
-def handle_user_profile_and_groups(sender, instance, created, **kwargs):
+def handle_user_profile_and_groups(sender, instance, created, update_fields=None, **kwargs):
     """
     Handle user group assignments when User is saved
     """
-    # Auto-approve and activate superusers
-    if instance.is_superuser:
-        instance.is_active = True
-        instance.is_approved = True
-        instance.approved_by = instance
-        instance.approved_at = timezone.now()
-        instance.save(update_fields=['is_active', 'is_approved', 'approved_by', 'approved_at'])
-
-    # Get or create the groups (in case they don't exist yet)
-    staff_group, _ = Group.objects.get_or_create(name='Staff')
-    admin_group, _ = Group.objects.get_or_create(name='Administrators')
-    doctors_group, _ = Group.objects.get_or_create(name='Doctors')
-    nurses_group, _ = Group.objects.get_or_create(name='Nurses')
-
-    # Clear all groups first
-    instance.groups.clear()
-
-    # Assign base groups
-    if instance.is_staff:
-        instance.groups.add(staff_group)
-    if instance.is_superuser:
-        instance.groups.add(admin_group)
-
-    # Assign role-specific groups
-    if instance.role == 'doctor':
-        instance.groups.add(doctors_group)
-    elif instance.role == 'nurse':
-        instance.groups.add(nurses_group)
-    elif instance.role == 'admin':
-        instance.groups.add(admin_group)
-    else:  # default staff
-        instance.groups.add(staff_group)
+    if instance.pk in getattr(_syncing, 'user_ids', ()):
+        return
+
+    # Auto-approve and activate superusers, on every save as before
+    approve_superuser(instance)
+
+    # Saves that only touch other fields (e.g. last_login) can't change groups
+    if created or update_fields is None or set(GROUP_SYNC_FIELDS) & set(update_fields):
+        _syncing.user_ids = getattr(_syncing, 'user_ids', set()) | {instance.pk}
+        try:
+            desired = desired_group_ids(instance)
+            current = set(instance.groups.values_list('id', flat=True))
+            if current - desired:
+                instance.groups.remove(*(current - desired))
+            if desired - current:
+                instance.groups.add(*(desired - current))
+        finally:
+            _syncing.user_ids = _syncing.user_ids - {instance.pk}
 
     # For new users with registration tokens
     if created and hasattr(instance, 'registration_token'):
         token = instance.registration_token
         token.used = True
-        token.save()
\ No newline at end of file
+        token.save()
+
+# Keep the cached authorization snapshots used by the decorators current
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_authorization_on_membership_change(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Changed from the Group/Permission side; affects an unknown set of users
+        invalidate_all()
+    else:
+        invalidate_user(instance.pk)
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_authorization_on_group_permissions(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_all()
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def invalidate_authorization_on_group_or_permission_change(sender, **kwargs):
+    """
+    Renaming a group changes role checks by group name; deleting a group or
+    permission drops its links without sending m2m_changed
+    """
+    if sender is Group:
+        forget_group_ids()
+    if not kwargs.get('created'):  # Nobody holds a new group or permission yet
+        invalidate_all()
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_authorization_on_profile_change(sender, instance, **kwargs):
+    """The stored snapshot holds the profile role the role decorators check first"""
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_authorization_on_user_save(sender, instance, **kwargs):
+    """Role and superuser/staff flags live on the user row"""
+    invalidate_user(instance.pk)
\ No newline at end of file
@@ -0,0 +1,306 @@
+"""
+Memory-mapped columnar snapshot of the survival dataset.
+
+Every ``SurvivalData`` record with a duration is stored as one row across
+plain ``.npy`` column files: ``patient_id``, ``duration``, ``event``, an
+integer code per curve grouping (labels in ``meta.json``), and the
+registered ``PatientSurvival.COVARIATES`` (NaN when missing). A snapshot is
+written once per data version into its own directory and opened with
+``mmap_mode='r'``, so every worker process shares the same page-cache
+pages and analytics never convert ORM rows. Versions come from the shared
+data version stamp (``cache.py``), so every process names the same data the
+same way.
+
+Snapshots are refreshed incrementally. The receivers log the patients each
+committed change touched under the data version it produced
+(``log_change``). When the current version has no snapshot on disk, the
+newest older one is patched by re-reading only those patients, provided
+every intermediate version's log is still in the cache and was written by
+a single change. Otherwise, as after a bulk import, it is rebuilt with one
+query.
+
+A superseded snapshot stays on disk for ``SNAPSHOT_GRACE`` seconds after
+its successor is published, since other processes may have just picked it
+as a base or be about to map it. Mappings already open survive deletion.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import PatientSurvival, SurvivalData
+from .cache import RESULT_TIMEOUT, bump_data_version, get_data_version, versioned_key
+
+GROUPINGS = list(SurvivalData.CURVE_GROUPINGS)
+COVARIATES = list(PatientSurvival.COVARIATES)
+
+# Rebuild instead of patching once this many patients changed since the base
+# snapshot, or after this many chained patches (bounds any drift)
+MAX_PATCHED_PATIENTS = 5000
+MAX_CHAINED_UPDATES = 500
+
+# Seconds a superseded version is kept on disk for processes still opening it
+SNAPSHOT_GRACE = 60 * 10
+
+NO_GROUP = -1
+
+
+def snapshot_dir():
+    path = getattr(settings, 'SURVIVAL_SNAPSHOT_DIR', None)
+    return Path(path) if path else Path(settings.BASE_DIR) / 'var' / 'survival_snapshot'
+
+
+class Snapshot:
+    """One data version of the survival dataset as (memory-mapped) column arrays"""
+
+    def __init__(self, version, columns, categories, chained_updates=0, path=None):
+        self.version = version
+        self.columns = columns
+        self.categories = categories
+        self.chained_updates = chained_updates
+        self.path = path
+
+    def __len__(self):
+        return len(self.columns['duration'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def durations(self):
+        return self.columns['duration']
+
+    @property
+    def events(self):
+        return self.columns['event']
+
+    def labels(self, group_by):
+        """Group labels of every row (None where the group is blank)"""
+        labels = np.array(self.categories[group_by] + [None], dtype=object)
+        return labels[self.columns[group_by]]
+
+    def mask(self, group_by, value):
+        """Boolean row mask for ``group_by == value``"""
+        try:
+            code = self.categories[group_by].index(value)
+        except ValueError:
+            return np.zeros(len(self), dtype=bool)
+        return self.columns[group_by] == code
+
+
+# --- Building ---
+
+def _query(patient_ids=None):
+    queryset = SurvivalData.objects.filter(days_in_care__isnull=False)
+    if patient_ids is not None:
+        queryset = queryset.filter(patient_id__in=patient_ids)
+    return list(queryset.values_list(
+        'patient_id', 'days_in_care', 'event', *GROUPINGS,
+        *(f'patient__patient_survival_record__{key}' for key in COVARIATES)
+    ))
+
+
+def _encode(rows, categories):
+    """Column arrays for ``rows``; new group labels are appended to ``categories``"""
+    columns = {
+        'patient_id': np.array([row[0] for row in rows], dtype=np.int64),
+        'duration': np.array([row[1] for row in rows], dtype=np.int64),
+        'event': np.array([bool(row[2]) for row in rows], dtype=bool),
+    }
+    for i, group_by in enumerate(GROUPINGS, start=3):
+        labels = categories.setdefault(group_by, [])
+        codes = {label: code for code, label in enumerate(labels)}
+        column = np.empty(len(rows), dtype=np.int32)
+        for j, row in enumerate(rows):
+            value = row[i]
+            if not value:
+                column[j] = NO_GROUP
+                continue
+            if value not in codes:
+                codes[value] = len(labels)
+                labels.append(value)
+            column[j] = codes[value]
+        columns[group_by] = column
+    for i, key in enumerate(COVARIATES, start=3 + len(GROUPINGS)):
+        columns[key] = np.array([row[i] for row in rows], dtype=np.float64)
+    return columns
+
+
+def build_snapshot(version):
+    """Read the whole dataset into a new (in-memory) ``Snapshot``"""
+    rows = _query()
+    labels = {group_by: sorted({row[i] for row in rows if row[i]})
+              for i, group_by in enumerate(GROUPINGS, start=3)}
+    return Snapshot(version, _encode(rows, labels), labels)
+
+
+def patch_snapshot(base, version, patient_ids):
+    """``base`` with every row of ``patient_ids`` re-read from the database"""
+    categories = {group_by: list(labels) for group_by, labels in base.categories.items()}
+    fresh = _encode(_query(patient_ids), categories)
+    keep = ~np.isin(base['patient_id'], np.fromiter(patient_ids, dtype=np.int64))
+    columns = {
+        name: np.concatenate([np.asarray(base[name])[keep], fresh[name]])
+        for name in fresh
+    }
+    return Snapshot(version, columns, categories, base.chained_updates + 1)
+
+
+# --- Storage ---
+
+def _version_path(version):
+    return snapshot_dir() / f'v{version}'
+
+
+def write_snapshot(snapshot):
+    """
+    Publish ``snapshot`` under its version directory.
+
+    Columns are written to a temporary directory that is renamed into place,
+    so readers never see a partial snapshot; if another process published
+    the same version first, this copy is discarded.
+    """
+    root = snapshot_dir()
+    root.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix='.staging-', dir=root))
+    try:
+        for name, column in snapshot.columns.items():
+            np.save(staging / f'{name}.npy', column)
+        (staging / 'meta.json').write_text(json.dumps({
+            'version': snapshot.version,
+            'rows': len(snapshot),
+            'categories': snapshot.categories,
+            'chained_updates': snapshot.chained_updates,
+        }))
+        os.rename(staging, _version_path(snapshot.version))
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not _version_path(snapshot.version).exists():
+            raise
+    _prune(keep=snapshot.version)
+    return _version_path(snapshot.version)
+
+
+def open_snapshot(path):
+    """Memory-map the snapshot stored at ``path``"""
+    path = Path(path)
+    meta = json.loads((path / 'meta.json').read_text())
+    columns = {
+        name: np.load(path / f'{name}.npy', mmap_mode='r')
+        for name in ['patient_id', 'duration', 'event', *GROUPINGS, *COVARIATES]
+    }
+    return Snapshot(meta['version'], columns, meta['categories'], meta['chained_updates'], path)
+
+
+def _stored_versions():
+    try:
+        entries = os.listdir(snapshot_dir())
+    except FileNotFoundError:
+        return []
+    versions = []
+    for entry in entries:
+        if entry.startswith('v') and entry[1:].isdigit():
+            versions.append(int(entry[1:]))
+    return sorted(versions)
+
+
+def _prune(keep):
+    """Delete versions superseded for longer than ``SNAPSHOT_GRACE``, never the newest"""
+    versions = _stored_versions()
+    cutoff = time.time() - SNAPSHOT_GRACE
+    for version, successor in zip(versions, versions[1:]):
+        if version == keep:
+            continue
+        try:
+            # A version is superseded from the moment its successor was published
+            superseded_at = _version_path(successor).stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if superseded_at < cutoff:
+            shutil.rmtree(_version_path(version), ignore_errors=True)
+
+
+# --- Change log ---
+
+# Stored in place of a step's log when more than one change was logged for it
+CONFLICTING_CHANGES = 'conflict'
+
+
+def log_change(version, patient_ids):
+    """Record the patients whose rows changed in the step to data ``version``"""
+    key = versioned_key('snapshot_changes', version=version)
+    if not cache.add(key, list(patient_ids), RESULT_TIMEOUT):
+        # Each commit gets its own version, so this means the version row
+        # was reset. One log would hide the other's patients, so the step
+        # is marked unknown and readers rebuild instead.
+        cache.set(key, CONFLICTING_CHANGES, RESULT_TIMEOUT)
+
+
+def record_change(patient_ids):
+    """Move to a new data version after a committed change to ``patient_ids``; returns it"""
+    version = bump_data_version()
+    log_change(version, patient_ids)
+    return version
+
+
+def changes_since(base_version, version):
+    """Patients changed between the two versions, or None if any step is unknown or conflicting"""
+    if version - base_version > MAX_CHAINED_UPDATES:
+        return None
+    keys = [versioned_key('snapshot_changes', version=v) for v in range(base_version + 1, version + 1)]
+    logs = cache.get_many(keys)
+    if len(logs) != len(keys) or CONFLICTING_CHANGES in logs.values():
+        return None
+    patient_ids = set()
+    for log in logs.values():
+        patient_ids.update(log)
+    return patient_ids
+
+
+# --- Access ---
+
+_local = {'version': None, 'snapshot': None}
+_local_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    The memory-mapped snapshot for the current data version, patched from
+    an older one or rebuilt from the database if it is not on disk yet.
+    """
+    version = get_data_version()
+    with _local_lock:
+        if _local['version'] == version:
+            return _local['snapshot']
+
+    path = _version_path(version)
+    if not path.exists():
+        snapshot = None
+        older = [v for v in _stored_versions() if v < version]
+        if older:
+            try:
+                base = open_snapshot(_version_path(older[-1]))
+            except FileNotFoundError:
+                base = None  # Pruned by another process since it was listed
+            changed = changes_since(base.version, version) if base else None
+            if (changed is not None and len(changed) <= MAX_PATCHED_PATIENTS
+                    and base.chained_updates < MAX_CHAINED_UPDATES):
+                snapshot = patch_snapshot(base, version, changed)
+        if snapshot is None:
+            snapshot = build_snapshot(version)
+        # Only publish if no write landed while the rows were being read
+        if get_data_version() != version:
+            return snapshot
+        path = write_snapshot(snapshot)
+
+    snapshot = open_snapshot(path)
+    with _local_lock:
+        _local.update(version=version, snapshot=snapshot)
+    return snapshot
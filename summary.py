@@ -0,0 +1,60 @@
+"""
+Case-count summaries of ``SurvivalData`` computed in the database.
+
+One grouped query with conditional counts returns totals per
+(diagnosis, level_of_care) pair; the overall, per-diagnosis and
+per-care-level figures are rolled up from those few rows in Python.
+"""
+from django.db.models import Case, Count, IntegerField, When
+
+from .models import SurvivalData
+
+
+def _rate(counts):
+    total = counts['total_cases']
+    counts['survival_rate'] = 1 - (counts['death_cases'] / total) if total else None
+    return counts
+
+
+def _grouped_counts():
+    return (
+        SurvivalData.objects.filter(days_in_care__isnull=False)
+        .values('diagnosis', 'level_of_care')
+        .annotate(
+            total=Count('pk'),
+            deaths=Count(Case(When(event=True, then=1), output_field=IntegerField())),
+        )
+        .order_by()
+    )
+
+
+def _roll_up(rows):
+    overall = {'total_cases': 0, 'death_cases': 0}
+    by_diagnosis = {}
+    by_care_level = {}
+    for row in rows:
+        groups = [overall, by_diagnosis.setdefault(row['diagnosis'], {'total_cases': 0, 'death_cases': 0})]
+        if row['level_of_care']:
+            groups.append(by_care_level.setdefault(row['level_of_care'], {'total_cases': 0, 'death_cases': 0}))
+        for counts in groups:
+            counts['total_cases'] += row['total']
+            counts['death_cases'] += row['deaths']
+
+    return {
+        'overall': _rate(overall),
+        'by_diagnosis': {key: _rate(by_diagnosis[key]) for key in sorted(by_diagnosis)},
+        'by_care_level': {key: _rate(by_care_level[key]) for key in sorted(by_care_level)},
+    }
+
+
+def survival_summary():
+    """
+    Return total/death counts and survival rate overall, per diagnosis and
+    per care level, for records with a known ``days_in_care``.
+    """
+    return _roll_up(_grouped_counts())
+
+
+async def asurvival_summary():
+    """Async version of ``survival_summary``"""
+    return _roll_up([row async for row in _grouped_counts()])
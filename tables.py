@@ -1,8 +1,170 @@
+import base64
+
 import django_tables2 as tables
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
 from .models import FormSubmission
 
+# Newest first; ``id`` breaks ties so the order (and every cursor) is total
+SUBMISSION_ORDERING = ('-submitted_at', '-id')
+SUBMISSIONS_PER_PAGE = 25
+
+# Above this many rows, page headers show an estimate instead of an exact count
+APPROXIMATE_COUNT_CAP = 10000
+
+
+def submission_queryset(status=None):
+    """FormSubmissions in listing order, with ``user`` and ``user_form`` joined up front"""
+    queryset = FormSubmission.objects.select_related('user', 'user_form').order_by(*SUBMISSION_ORDERING)
+    if status:
+        queryset = queryset.filter(status=status)
+    return queryset
+
+
+def encode_cursor(submission):
+    """Opaque cursor pointing at ``submission``'s position in the listing"""
+    value = f'{submission.submitted_at.isoformat()}|{submission.pk}'
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return ``(submitted_at, id)`` for a cursor, or None if it is malformed"""
+    try:
+        submitted_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        submitted_at = parse_datetime(submitted_at)
+        pk = int(pk)
+    except (ValueError, UnicodeError):
+        return None
+    if submitted_at is None:
+        return None
+    return submitted_at, pk
+
+
+class KeysetPage:
+    """
+    One page of the submission listing, fetched by keyset rather than OFFSET.
+
+    Each page is a ``WHERE (submitted_at, id) < cursor ... LIMIT n`` range
+    scan on the ordering index, so page 10,000 costs the same as page 1.
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_page(queryset, cursor=None, per_page=SUBMISSIONS_PER_PAGE, backwards=False):
+    """
+    Return the page of ``queryset`` after ``cursor`` (or before it when
+    ``backwards``), in ``SUBMISSION_ORDERING``. A missing or malformed cursor
+    gives the first page.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    if position is None:
+        backwards = False
+    else:
+        submitted_at, pk = position
+        if backwards:
+            queryset = queryset.filter(
+                Q(submitted_at__gt=submitted_at) | Q(submitted_at=submitted_at, id__gt=pk)
+            ).reverse()
+        else:
+            queryset = queryset.filter(
+                Q(submitted_at__lt=submitted_at) | Q(submitted_at=submitted_at, id__lt=pk)
+            )
+
+    # One extra row tells us whether there is another page in this direction
+    rows = list(queryset[:per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage(rows)
+    if backwards:
+        has_next, has_previous = True, more
+    else:
+        has_next, has_previous = more, position is not None
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if has_next else None,
+        previous_cursor=encode_cursor(rows[0]) if has_previous else None,
+    )
+
+
+def approximate_count(queryset, cap=APPROXIMATE_COUNT_CAP):
+    """
+    Row count for page headers without an unbounded ``COUNT(*)``.
+
+    Counts exactly up to ``cap`` rows. Beyond that, returns the planner's
+    row estimate for an unfiltered listing on PostgreSQL, or ``cap`` itself.
+    Returns ``(count, is_exact)``.
+    """
+    count = queryset.order_by()[:cap + 1].count()
+    if count <= cap:
+        return count, True
+
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 (or 0 on older servers) until the table is analyzed
+        if row and row[0] > cap:
+            return row[0], False
+    return cap, False
+
+
 class FormSubmissionTable(tables.Table):
     class Meta:
         model = FormSubmission
         fields = ('id', 'submitted_at', 'user', 'user_form', 'title', 'status')  # Fields to display
-        attrs = {'class': 'table table-bordered table-striped'}  # Add Bootstrap classes (optional)
\ No newline at end of file
+        attrs = {'class': 'table table-bordered table-striped'}  # Add Bootstrap classes (optional)
+        orderable = False  # Rows come in keyset order, see SUBMISSION_ORDERING
+
+    @classmethod
+    def from_request(cls, request, per_page=SUBMISSIONS_PER_PAGE, count='approximate'):
+        """
+        Build the table for one keyset page of the listing.
+
+        Reads ``?status=``, ``?cursor=`` and ``?before=1`` (page backwards).
+        ``count`` is ``'approximate'``, ``'exact'`` or None to skip counting;
+        the result is on ``table.total`` and ``table.total_is_exact``, and the
+        cursors for the neighbouring pages on ``table.keyset``.
+        """
+        queryset = submission_queryset(request.GET.get('status'))
+        page = keyset_page(
+            queryset,
+            cursor=request.GET.get('cursor'),
+            per_page=per_page,
+            backwards=request.GET.get('before') == '1',
+        )
+
+        table = cls(page.object_list)
+        table.keyset = page  # Not ``table.page``, which django-tables2 reserves for its paginator
+        table.total, table.total_is_exact = None, False
+        if count == 'exact':
+            table.total, table.total_is_exact = queryset.count(), True
+        elif count == 'approximate':
+            table.total, table.total_is_exact = approximate_count(queryset)
+        return table
@@ -0,0 +1,140 @@
+import tempfile
+
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .authz import get_authorization
+from .decorators import doctor_required
+from .models import User, UserProfile
+from .signals import get_group_ids, sync_user_groups
+
+SHARED_CACHE = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache'}
+
+
+class SharedCacheTestCase(TestCase):
+    """Runs with a cache shared the way the production backends are"""
+
+    @classmethod
+    def setUpClass(cls):
+        cache_dir = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cache_dir.cleanup)
+        cls.enterClassContext(override_settings(CACHES={'default': {**SHARED_CACHE, 'LOCATION': cache_dir.name}}))
+        super().setUpClass()
+
+    def setUp(self):
+        cache.clear()
+
+
+class AuthorizationInvalidationTests(SharedCacheTestCase):
+    """A stored authorization snapshot is dropped by every change that affects it"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='doctor', role='doctor')
+        self.group = Group.objects.create(name='Reviewers')
+        self.permission = Permission.objects.get(codename='view_group')
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.user.pk)
+        return request
+
+    def authorization(self):
+        return get_authorization(self.request())
+
+    def test_snapshot_is_reused_between_requests(self):
+        self.authorization()
+        with self.assertNumQueries(1):  # Only the user row
+            self.assertIn('Doctors', self.authorization().groups)
+
+    def test_group_membership_change(self):
+        self.authorization()
+        self.user.groups.add(self.group)
+        self.assertIn('Reviewers', self.authorization().groups)
+        self.group.user_set.remove(self.user)
+        self.assertNotIn('Reviewers', self.authorization().groups)
+
+    def test_group_rename(self):
+        self.user.groups.add(self.group)
+        self.authorization()
+        self.group.name = 'Auditors'
+        self.group.save()
+        self.assertIn('Auditors', self.authorization().groups)
+
+    def test_group_permission_change(self):
+        self.user.groups.add(self.group)
+        self.assertFalse(self.authorization().has_perm('auth.view_group'))
+        self.group.permissions.add(self.permission)
+        self.assertTrue(self.authorization().has_perm('auth.view_group'))
+
+    def test_permission_delete(self):
+        self.user.user_permissions.add(self.permission)
+        self.assertTrue(self.authorization().has_perm('auth.view_group'))
+        self.permission.delete()
+        self.assertFalse(self.authorization().has_perm('auth.view_group'))
+
+    def test_role_change(self):
+        self.authorization()
+        self.user.role = 'nurse'
+        self.user.save()
+        authorization = self.authorization()
+        self.assertEqual(authorization.role, 'nurse')
+        self.assertEqual(authorization.groups, ['Nurses'])
+
+    def test_profile_role_change(self):
+        view = doctor_required(lambda request: HttpResponse())
+        profile = UserProfile.objects.create(user=self.user, role='doctor')
+        self.assertEqual(view(self.request()).status_code, 200)
+        profile.role = 'nurse'
+        profile.save()
+        self.assertEqual(view(self.request()).status_code, 403)
+
+        profile.role = 'doctor'
+        profile.save()
+        self.assertEqual(view(self.request()).status_code, 200)
+        profile.delete()
+        self.assertEqual(view(self.request()).status_code, 403)
+
+    def test_not_reused_without_a_shared_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.authorization()
+            with CaptureQueriesContext(connection) as queries:
+                self.authorization()
+        # More than the user row: groups and permissions were loaded again
+        self.assertGreater(len(queries), 1)
+
+
+class GroupSyncTests(SharedCacheTestCase):
+    def groups(self, user):
+        return set(user.groups.values_list('name', flat=True))
+
+    def test_group_ids_are_cached_until_a_group_changes(self):
+        group_ids = get_group_ids()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_group_ids(), group_ids)
+
+        Group.objects.get(name='Nurses').delete()
+        self.assertNotEqual(get_group_ids()['Nurses'], group_ids['Nurses'])
+        self.assertTrue(Group.objects.filter(pk=get_group_ids()['Nurses']).exists())
+
+    def test_bulk_sync(self):
+        # bulk_create sends no post_save, so nobody is in a group yet
+        users = User.objects.bulk_create([
+            User(username='doctor', role='doctor'),
+            User(username='nurse', role='nurse', is_staff=True),
+            User(username='root', role='admin', is_superuser=True),
+        ])
+        self.assertEqual(sync_user_groups(users), 3)
+        self.assertEqual([self.groups(user) for user in users], [
+            {'Doctors'}, {'Nurses', 'Staff'}, {'Administrators'},
+        ])
+        self.assertTrue(User.objects.get(username='root').is_approved)
+
+        users[0].role = 'nurse'
+        with self.assertNumQueries(5):  # Memberships, then one delete and one insert in a savepoint
+            self.assertEqual(sync_user_groups(users), 1)
+        self.assertEqual(self.groups(users[0]), {'Nurses'})
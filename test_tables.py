@@ -0,0 +1,49 @@
+import datetime
+
+from django.test import TestCase
+
+from .factories import make
+from .models import FormSubmission
+from .tables import keyset_page, submission_queryset
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        submissions = [make(FormSubmission, i) for i in range(7)]
+        # Pairs share a timestamp, so the id tiebreak decides their order
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        for i, submission in enumerate(submissions):
+            FormSubmission.objects.filter(pk=submission.pk).update(
+                submitted_at=start + datetime.timedelta(days=i // 2)
+            )
+        self.expected = list(submission_queryset().values_list('pk', flat=True))
+
+    def pages(self, cursor=None, backwards=False):
+        """Walk the listing from ``cursor`` to its end, collecting pages of pks"""
+        pages = []
+        while True:
+            page = keyset_page(submission_queryset(), cursor, per_page=3, backwards=backwards)
+            pages.append([submission.pk for submission in page])
+            cursor = page.previous_cursor if backwards else page.next_cursor
+            if cursor is None:
+                return pages
+
+    def test_walks_every_row_once_in_order(self):
+        pages = self.pages()
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), self.expected)
+
+    def test_walks_back_to_the_first_page(self):
+        cursor = None
+        for _ in range(2):
+            cursor = keyset_page(submission_queryset(), cursor, per_page=3).next_cursor
+        last = keyset_page(submission_queryset(), cursor, per_page=3)
+        self.assertFalse(last.has_next)
+        self.assertTrue(last.has_previous)
+        self.assertEqual(self.pages(last.previous_cursor, backwards=True),
+                         [self.expected[3:6], self.expected[:3]])
+
+    def test_malformed_cursor_gives_first_page(self):
+        page = keyset_page(submission_queryset(), 'not-a-cursor', per_page=3)
+        self.assertEqual([submission.pk for submission in page], self.expected[:3])
+        self.assertFalse(page.has_previous)
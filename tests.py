@@ -1,3 +1,420 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Permission
+from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from lifelines import KaplanMeierFitter
+from lifelines.statistics import multivariate_logrank_test, pairwise_logrank_test
+
+from app1.factories import make
+from app1.models import PatientDemographics, User
+from .cache import aget_data_version, bump_data_version, get_data_version, reset_data_version, versioned_key
+from . import async_views, compute, jobs, risk, views
+from .figures import km_figure, plotly_js_url
+from .importer import import_survival_frame
+from .jobs import _process_job
+from .incremental import SurvivalCounts, read_curve
+from .km import curve_from_counts, grouped_kaplan_meier, kaplan_meier, logrank
+from .models import RiskScore, SurvivalData, SurvivalImportJob, SurvivalRiskModel
+from .risk import ARTIFACT_FORMAT, CURRENT_MODEL_KEY, get_risk_model, score_active_patients
+from .snapshot import SNAPSHOT_GRACE, _prune, build_snapshot, changes_since, get_snapshot, log_change
+
+
+def survival_sample(size=300, seed=0):
+    """Durations with ties, a mix of deaths and censoring, and three groups"""
+    rng = np.random.default_rng(seed)
+    durations = rng.integers(1, 60, size)
+    events = rng.random(size) < 0.6
+    groups = rng.choice(['a', 'b', 'c'], size)
+    return durations, events, groups
+
+
+class KaplanMeierTests(SimpleTestCase):
+    """The vectorized estimator and log-rank tests agree with lifelines"""
+
+    def assertMatchesLifelines(self, curve, durations, events):
+        kmf = KaplanMeierFitter().fit(durations, events)
+        np.testing.assert_allclose(curve['timeline'], kmf.survival_function_.index)
+        np.testing.assert_allclose(curve['KM_estimate'], kmf.survival_function_['KM_estimate'])
+        np.testing.assert_allclose(curve['ci_lower'], kmf.confidence_interval_.iloc[:, 0])
+        np.testing.assert_allclose(curve['ci_upper'], kmf.confidence_interval_.iloc[:, 1])
+
+    def test_curve_matches_lifelines(self):
+        durations, events, _ = survival_sample()
+        self.assertMatchesLifelines(kaplan_meier(durations, events), durations, events)
+
+    def test_grouped_curves_match_lifelines(self):
+        durations, events, groups = survival_sample()
+        curves = grouped_kaplan_meier(durations, events, groups)
+        self.assertEqual(sorted(curves), ['a', 'b', 'c'])
+        for group, curve in curves.items():
+            mask = groups == group
+            self.assertMatchesLifelines(curve, durations[mask], events[mask])
+
+    def test_curve_from_counts_matches_fit(self):
+        durations, events, _ = survival_sample()
+        times = np.unique(durations)
+        observed = np.array([events[durations == t].sum() for t in times])
+        removed = np.array([(durations == t).sum() for t in times])
+        pd.testing.assert_frame_equal(
+            curve_from_counts(times, observed, removed), kaplan_meier(durations, events),
+            check_dtype=False,
+        )
+
+    def test_logrank_matches_lifelines(self):
+        durations, events, groups = survival_sample()
+        result = logrank(durations, events, groups)
+
+        expected = multivariate_logrank_test(durations, groups, events)
+        self.assertAlmostEqual(result['test']['statistic'], expected.test_statistic)
+        self.assertAlmostEqual(result['test']['p_value'], expected.p_value)
+        self.assertEqual(result['test']['df'], 2)
+
+        pairwise = pairwise_logrank_test(durations, groups, events).summary
+        self.assertEqual(len(result['pairwise']), len(pairwise))
+        for pair in result['pairwise']:
+            row = pairwise.loc[tuple(pair['groups'])]
+            self.assertAlmostEqual(pair['statistic'], row['test_statistic'])
+            self.assertAlmostEqual(pair['p_value'], row['p'])
+
+    def test_logrank_needs_two_groups(self):
+        durations, events, _ = survival_sample()
+        result = logrank(durations, events, ['a'] * len(durations))
+        self.assertIsNone(result['test'])
+        self.assertEqual(result['pairwise'], [])
+
+    def test_logrank_without_deaths(self):
+        durations, _, groups = survival_sample()
+        result = logrank(durations, np.zeros(len(durations), dtype=bool), groups)
+        self.assertIsNone(result['test'])
+        self.assertEqual(result['pairwise'], [])
+        self.assertEqual(result['observed'], {'a': 0, 'b': 0, 'c': 0})
+
+    def test_pairs_without_deaths_are_not_tested(self):
+        durations, events, groups = survival_sample()
+        events = events & (groups == 'a')
+        result = logrank(durations, events, groups)
+        self.assertIsNotNone(result['test'])
+        untested = [pair['groups'] for pair in result['pairwise'] if pair['p_value'] is None]
+        self.assertEqual(untested, [['b', 'c']])
+
+    def test_band_is_drawn_under_the_curve(self):
+        durations, events, _ = survival_sample()
+        upper, lower, line = km_figure(kaplan_meier(durations, events), 'Survival').data
+        self.assertEqual((upper.fill, lower.fill), (None, 'tonexty'))
+        self.assertEqual(line.line.width, None)
+        np.testing.assert_allclose(line.y, kaplan_meier(durations, events)['KM_estimate'])
+
+
+class DataVersionTests(TestCase):
+    def test_every_bump_gets_its_own_version(self):
+        start = get_data_version()
+        self.assertEqual([bump_data_version() for _ in range(3)], [start + 1, start + 2, start + 3])
+        self.assertEqual(get_data_version(), start + 3)
+        self.assertEqual(async_to_sync(aget_data_version)(), start + 3)
+
+    def test_reset_moves_past_rolled_back_versions(self):
+        start = get_data_version()
+        with transaction.atomic():
+            rolled_back = [bump_data_version() for _ in range(3)]
+            transaction.set_rollback(True)
+        self.assertEqual(get_data_version(), start)
+        reset_data_version()
+        self.assertGreater(get_data_version(), max(rolled_back))
+
+
+class ImporterTests(TestCase):
+    def setUp(self):
+        self.patients = [make(PatientDemographics, i, referral_number=f'R{i}') for i in range(3)]
+
+    def test_reports_rows_it_cannot_import(self):
+        df = pd.DataFrame({
+            'Ref Number': ['R0', 'R1', 'R2', 'UNKNOWN', None, 'R1'],
+            'Diagnosis': ['Cancer'] * 6,
+            'DaysInCare': [10, 'ten', 30, 5, 5, -1],
+            'FileStatus': ['Closed - Died', 'Active', 'Sleeping', 'Active', 'Active', 'Active'],
+            'DateCaseRegistered': ['2024-01-01'] * 6,
+        })
+        report = import_survival_frame(df)
+
+        # Row numbers are spreadsheet rows: the header is row 1
+        self.assertEqual(report['errors'], [
+            {'row': 3, 'referral_number': 'R1', 'error': 'DaysInCare is not a number'},
+            {'row': 4, 'referral_number': 'R2', 'error': 'Unknown FileStatus'},
+            {'row': 5, 'referral_number': 'UNKNOWN', 'error': 'No patient with this referral number'},
+            {'row': 6, 'referral_number': None, 'error': 'Missing Ref Number'},
+            {'row': 7, 'referral_number': 'R1', 'error': 'DaysInCare cannot be negative'},
+        ])
+        self.assertEqual((report['created'], report['updated']), (1, 0))
+        record = SurvivalData.objects.get()
+        self.assertEqual((record.patient, record.days_in_care, record.event), (self.patients[0], 10, True))
+
+    def test_row_numbers_of_a_later_chunk(self):
+        df = pd.DataFrame({'Ref Number': ['UNKNOWN']})
+        report = import_survival_frame(df, row_offset=1000)
+        self.assertEqual(report['errors'][0]['row'], 1002)
+
+    def test_missing_ref_number_column(self):
+        report = import_survival_frame(pd.DataFrame({'Diagnosis': ['Cancer']}))
+        self.assertEqual(report['errors'], [{
+            'row': None, 'referral_number': None, 'error': "Missing required column 'Ref Number'",
+        }])
+
+
+class ImportJobTests(TestCase):
+    def setUp(self):
+        self.import_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(SURVIVAL_IMPORT_ROOT=self.import_root))
+        make(PatientDemographics, 0, referral_number='R0')
+
+    def job(self, content):
+        return SurvivalImportJob.objects.create(file=SimpleUploadedFile('survival.xlsx', content))
+
+    def spreadsheet(self):
+        output = io.BytesIO()
+        pd.DataFrame({'Ref Number': ['R0'], 'Diagnosis': ['Cancer'], 'DaysInCare': [10]}).to_excel(output, index=False)
+        return output.getvalue()
+
+    def assertUploadDeleted(self, job, path):
+        job.refresh_from_db()
+        self.assertFalse(job.file)
+        self.assertFalse(os.path.exists(path))
+
+    def test_upload_is_private_and_deleted_on_completion(self):
+        job = self.job(self.spreadsheet())
+        path = job.file.path
+        self.assertTrue(path.startswith(self.import_root))
+        _process_job(job)
+        self.assertEqual(job.status, 'completed')
+        self.assertUploadDeleted(job, path)
+
+    def test_upload_is_deleted_on_failure(self):
+        job = self.job(b'not a spreadsheet')
+        path = job.file.path
+        _process_job(job)
+        self.assertEqual(job.status, 'failed')
+        self.assertUploadDeleted(job, path)
+
+
+class RiskModelTests(TestCase):
+    def setUp(self):
+        # No model loaded in this process, nor a version cached, by earlier tests
+        self.enterContext(mock.patch.object(risk, '_loaded', None))
+        cache.delete(CURRENT_MODEL_KEY)
+
+    def store_model(self):
+        # Cancer doubles the hazard, which is a 50% risk at 90 days for the reference level
+        return SurvivalRiskModel.objects.create(n_records=2, n_events=1, artifact={
+            'format': ARTIFACT_FORMAT, 'features': ['diagnosis=Cancer'], 'covariates': [], 'fill': {},
+            'coefficients': [float(np.log(2))], 'means': [0.0],
+            'baseline': {'timeline': [0.0, 90.0], 'survival': [1.0, 0.5]},
+        })
+
+    def request(self, user, method='post'):
+        request = getattr(RequestFactory(), method)('/')
+        request.user = user
+        return request
+
+    def test_falls_back_when_the_current_model_is_deleted(self):
+        older, newer = self.store_model(), self.store_model()
+        cache.set(CURRENT_MODEL_KEY, newer.pk, None)
+        # Deleted behind the cache's back, as with a raw delete
+        SurvivalRiskModel.objects.filter(pk=newer.pk)._raw_delete(newer._state.db)
+        self.assertEqual(get_risk_model().version, older.pk)
+
+    def test_none_once_every_model_is_gone(self):
+        model = self.store_model()
+        cache.set(CURRENT_MODEL_KEY, model.pk, None)
+        SurvivalRiskModel.objects.filter(pk=model.pk)._raw_delete(model._state.db)
+        self.assertIsNone(get_risk_model())
+
+    def test_scores_one_row_per_patient(self):
+        self.store_model()
+        patient = make(PatientDemographics, 0)
+        make(SurvivalData, 0, patient=patient, diagnosis='COPD', file_status='active')
+        riskiest = make(SurvivalData, 1, patient=patient, diagnosis='Cancer', file_status='active')
+        other = make(SurvivalData, 2, diagnosis='COPD', file_status='active')
+        make(SurvivalData, 3, diagnosis='Cancer', file_status='closed_died')
+
+        self.assertEqual(score_active_patients(), 2)
+        self.assertEqual(
+            list(RiskScore.objects.order_by('-risk').values_list('patient', 'survival_data', 'risk')),
+            [(patient.pk, riskiest.pk, 0.75), (other.patient_id, other.pk, 0.5)],
+        )
+
+    def test_rescoring_needs_permission(self):
+        self.store_model()
+        user = User.objects.create(username='nurse', role='nurse')
+        with mock.patch('survival_analysis.views.submit_risk_scoring') as submit:
+            with self.assertRaises(PermissionDenied):
+                views.risk_ranking(self.request(user))
+            submit.assert_not_called()
+
+            user.user_permissions.add(Permission.objects.get(codename='change_riskscore'))
+            user = User.objects.get(pk=user.pk)
+            self.assertEqual(views.risk_ranking(self.request(user)).status_code, 202)
+            submit.assert_called_once_with()
+
+    def test_ranking(self):
+        model = self.store_model()
+        other = make(SurvivalData, 0, diagnosis='COPD', file_status='active')
+        riskiest = make(SurvivalData, 1, diagnosis='Cancer', file_status='active')
+        score_active_patients()
+
+        response = views.risk_ranking(self.request(User.objects.create(username='doctor'), 'get'))
+        ranking = json.loads(response.content)
+        self.assertEqual((ranking['model_version'], ranking['num_pages']), (model.pk, 1))
+        self.assertEqual([(p['survival_data_id'], p['risk']) for p in ranking['patients']],
+                         [(riskiest.pk, 0.75), (other.pk, 0.5)])
+
+    def test_failed_rescoring_is_logged(self):
+        future = Future()
+        with mock.patch.object(jobs, '_submit', return_value=future), mock.patch.object(jobs, '_scoring', None):
+            self.assertTrue(jobs.submit_risk_scoring())
+            self.assertFalse(jobs.submit_risk_scoring())
+            with self.assertLogs('survival_analysis.jobs', 'ERROR') as logs:
+                future.set_exception(RuntimeError('boom'))
+        self.assertEqual(str(logs.records[0].exc_info[1]), 'boom')
+
+
+class SurvivalPageTests(TestCase):
+    def setUp(self):
+        for i in range(6):
+            make(SurvivalData, i, diagnosis=['Cancer', 'COPD'][i % 2], days_in_care=i + 1,
+                 file_status=['active', 'closed_died'][i // 3])
+
+    def test_first_figure_loads_plotly_js(self):
+        context = views._build_survival_context()
+        figures = [context['overall_plot'], *context['diagnosis_plots'].values()]
+        script = f'src="{plotly_js_url()}"'
+        self.assertEqual([figure.count(script) for figure in figures], [1, 0, 0])
+
+    def test_async_context_matches_sync(self):
+        def shutdown():
+            compute.get_process_pool().shutdown()
+            compute._pool = None
+        self.addCleanup(shutdown)
+
+        expected = views._build_survival_context()
+        context = async_to_sync(async_views._build_survival_context)()
+        self.assertEqual(context.keys(), expected.keys())
+        self.assertEqual((context['diagnoses'], context['comparisons']), (expected['diagnoses'], expected['comparisons']))
+        self.assertEqual(async_to_sync(async_views._overall_survival_graph)(), views._overall_survival_graph())
+
+
+class SnapshotTests(TestCase):
+    """A snapshot patched with the logged changes matches one rebuilt from the database"""
+
+    def setUp(self):
+        # Rolled-back rows send no signals, so no test may patch another's snapshot
+        snapshot_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(SURVIVAL_SNAPSHOT_DIR=snapshot_dir))
+        cache.clear()
+
+        rng = np.random.default_rng(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.records = [
+                make(SurvivalData, i,
+                     days_in_care=int(rng.integers(1, 100)),
+                     diagnosis=rng.choice(['Cancer', 'COPD']),
+                     level_of_care=rng.choice(['low', 'high']),
+                     file_status=rng.choice(['active', 'closed_died']))
+                for i in range(20)
+            ]
+        self.base = get_snapshot()
+
+    def change_records(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.records[0].file_status = 'closed_died'
+            self.records[0].diagnosis = 'Dementia'
+            self.records[0].save()
+            self.records[1].delete()
+            self.records[2].patient = self.records[3].patient
+            self.records[2].save()
+            make(SurvivalData, 100, days_in_care=5, diagnosis='Stroke', file_status='closed_died')
+
+    def assertSameRows(self, snapshot, expected):
+        def rows(s):
+            order = np.lexsort((s.durations, s['patient_id']))
+            return pd.DataFrame({
+                'patient_id': np.asarray(s['patient_id'])[order],
+                'duration': np.asarray(s.durations)[order],
+                'event': np.asarray(s.events)[order],
+                **{group_by: s.labels(group_by)[order] for group_by in SurvivalData.CURVE_GROUPINGS},
+            })
+        pd.testing.assert_frame_equal(rows(snapshot), rows(expected))
+
+    def test_patch_matches_rebuild(self):
+        self.change_records()
+        snapshot = get_snapshot()
+        self.assertEqual(snapshot.chained_updates, self.base.chained_updates + 1)
+        self.assertSameRows(snapshot, build_snapshot(snapshot.version))
+
+    def test_rebuilds_without_the_change_log(self):
+        self.change_records()
+        # Changes were logged one per version step; losing any forces a rebuild
+        cache.delete(versioned_key('snapshot_changes', version=self.base.version + 1))
+        snapshot = get_snapshot()
+        self.assertEqual(snapshot.chained_updates, 0)
+        self.assertSameRows(snapshot, build_snapshot(snapshot.version))
+
+    def test_a_version_logged_twice_is_unknown(self):
+        version = self.base.version + 1
+        log_change(version, [self.records[0].patient_id])
+        self.assertEqual(changes_since(self.base.version, version), {self.records[0].patient_id})
+        log_change(version, [self.records[1].patient_id])
+        self.assertIsNone(changes_since(self.base.version, version))
+
+    def test_prune_keeps_recently_superseded_versions(self):
+        self.change_records()
+        current = get_snapshot()
+        # Another process may still be about to open the version it replaced
+        self.assertTrue(self.base.path.exists())
+
+        published = time.time() - SNAPSHOT_GRACE - 1
+        os.utime(current.path, (published, published))
+        _prune(keep=current.version)
+        self.assertFalse(self.base.path.exists())
+        self.assertTrue(current.path.exists())
+
+    def test_rebuilds_when_the_base_is_pruned_while_reading(self):
+        self.change_records()
+        shutil.rmtree(self.base.path)
+        with mock.patch('survival_analysis.snapshot._stored_versions', return_value=[self.base.version]):
+            snapshot = get_snapshot()
+        self.assertEqual(snapshot.chained_updates, 0)
+        self.assertSameRows(snapshot, build_snapshot(snapshot.version))
+
+    def test_incremental_counts_match_a_refit(self):
+        read_curve()
+        self.change_records()
+        records = SurvivalData.objects.values_list('days_in_care', 'event', 'diagnosis')
+        durations, events, diagnoses = (np.array(column) for column in zip(*records))
+        pd.testing.assert_frame_equal(read_curve(), kaplan_meier(durations, events), check_dtype=False)
+        pd.testing.assert_frame_equal(
+            read_curve('diagnosis', 'Dementia'),
+            kaplan_meier(durations[diagnoses == 'Dementia'], events[diagnoses == 'Dementia']),
+            check_dtype=False,
+        )
+
+    def test_counts_have_a_column_per_distinct_duration(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make(SurvivalData, 100, days_in_care=10 ** 9, file_status='closed_died')
+        counts = SurvivalCounts(get_snapshot())
+        durations = SurvivalData.objects.values_list('days_in_care', flat=True)
+        np.testing.assert_array_equal(counts.times, sorted(set(durations)))
+        self.assertEqual(counts.removed[None].shape, (1, len(counts.times)))
+        self.assertEqual(counts.curve()['timeline'].iloc[-1], 10 ** 9)
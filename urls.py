@@ -1,10 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+# Under ASGI, serve the heavy analytics pages with their async versions
+analytics_views = async_views if getattr(settings, 'SURVIVAL_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
-    path('analysis/', views.survival, name='survival_analysis'),
+    path('analysis/', analytics_views.survival, name='survival_analysis'),
     path('survival/add/', views.add_survival_data, name='add_survival_data'),
     path('survival/import/', views.import_survival_data, name='import_survival_data'),
+    path('survival/import/<int:job_id>/status/', views.import_job_status, name='import_job_status'),
     path('patient/<int:patient_id>/', views.individual_prediction, name='individual_prediction'),
-    path('export/', views.export_survival_data, name='export_survival_data'),
+    path('risk/', views.risk_ranking, name='risk_ranking'),
+    path('export/', analytics_views.export_survival_data, name='export_survival_data'),
+    path('api/curves/<str:group_by>/', views.survival_curve, name='survival_curve'),
+    path('api/comparisons/<str:group_by>/', views.survival_comparison, name='survival_comparison'),
+    path('assets/plotly-<str:version>.min.js', views.plotly_js, name='plotly_js'),
 ]
\ No newline at end of file
@@ -1,131 +1,143 @@
+import itertools
+
 import pandas as pd
-from lifelines import KaplanMeierFitter
-from django.shortcuts import render, redirect
-from .models import PatientSurvival, SurvivalData
+from django.shortcuts import render, redirect, get_object_or_404
+from django.core.paginator import Paginator
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse
+from django.views.decorators.cache import cache_control
+from django.urls import reverse
+from .models import PatientSurvival, RiskScore, SurvivalData, SurvivalImportJob
 from app1.models import PatientDemographics
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 import io
 import base64
 from django.contrib import messages
 from .forms import SurvivalDataForm
+from .cache import get_or_compute, get_data_version
+from .km import kaplan_meier
+from .curves import GROUPINGS, curve_json, group_comparison, group_comparisons
+from .summary import survival_summary
+from .incremental import read_curve, read_group_values
+from .importer import import_survival_frame
+from .jobs import submit_import_job, submit_risk_scoring
+from .exports import iter_csv, write_xlsx
+from .risk import RISK_HORIZONS, get_risk_model
+from .figures import km_figure, overall_graph_figure, plotly_js_source, plotly_js_url, render_figure
 import plotly.express as px
-from plotly.offline import plot
+from plotly.offline import get_plotlyjs_version, plot
 import plotly.graph_objects as go
 
 
-def survival(request):
-    try:
-        # Query data from both models
-        patient_records = PatientSurvival.objects.all()
-        survival_records = SurvivalData.objects.all()
+def _survival_curves():
+    """Curves and log-rank comparisons of ``SurvivalData``"""
+    # Read from the incrementally maintained counts, not refit
+    return {
+        'overall_curve': read_curve(),
+        'diagnosis_curves': {
+            diagnosis: read_curve('diagnosis', diagnosis)
+            for diagnosis in read_group_values('diagnosis')
+        },
+        'comparisons': group_comparisons(),
+    }
+
+
+def _render_survival_context(patient_rows, has_survival_data, plotly_js, curves):
+    """
+    Fit the patient curve and render every figure for results.html. Takes
+    plain data and never touches the ORM, so it can run in the compute pool.
+    """
+    if not patient_rows and not has_survival_data:
+        return {
+            'has_data': False,
+            'message': 'No survival data available. Please add data first.'
+        }
+
+    context = {'has_data': True}
+
+    # The first figure on the page loads the shared plotly.js bundle; the
+    # ones after it reuse it
+    plotlyjs = itertools.chain([plotly_js], itertools.repeat(False))
+
+    # --- 1. PatientSurvival Analysis ---
+    if patient_rows:
+        df_patient = pd.DataFrame.from_records(patient_rows, columns=['duration', 'event_occurred'])
+
+        context['patient_plot'] = render_figure(km_figure(
+            kaplan_meier(df_patient['duration'], df_patient['event_occurred']),
+            '<b>Patient Survival Analysis</b>'
+        ), next(plotlyjs))
+
+    # --- 2. SurvivalData Analysis ---
+    if has_survival_data:
+        overall_curve = curves['overall_curve']
+        overall_plot = render_figure(km_figure(
+            overall_curve, '<b>Overall Survival Analysis</b>'
+        ), next(plotlyjs)) if overall_curve is not None else None
+
+        diagnosis_plots = {
+            diagnosis: render_figure(km_figure(curve, f'<b>Diagnosis: {diagnosis}</b>', styled=False), next(plotlyjs))
+            for diagnosis, curve in curves['diagnosis_curves'].items()
+            if curve is not None
+        }
+
+        context.update({
+            'overall_plot': overall_plot,
+            'diagnosis_plots': diagnosis_plots,
+            'diagnoses': list(diagnosis_plots),
+            'comparisons': curves['comparisons'],
+        })
 
-        if not patient_records.exists() and not survival_records.exists():
-            return render(request, 'survival_analysis/results.html', {
-                'has_data': False,
-                'message': 'No survival data available. Please add data first.'
-            })
+    return context
 
-        context = {'has_data': True}
 
-        # --- 1. PatientSurvival Analysis ---
-        if patient_records.exists():
-            df_patient = pd.DataFrame.from_records(patient_records.values(
-                'event_occurred', 'entry_date', 'last_followup'
-            ))
-            df_patient['duration'] = (pd.to_datetime(df_patient['last_followup']) -
-                                      pd.to_datetime(df_patient['entry_date'])).dt.days
+def _build_survival_context():
+    """Fit the survival curves and render their figures for results.html"""
+    # duration is materialized on save, so only two narrow columns are read
+    patient_rows = list(PatientSurvival.objects.values_list('duration', 'event_occurred'))
+    has_survival_data = SurvivalData.objects.exists()
+    curves = _survival_curves() if has_survival_data else {}
+    return _render_survival_context(patient_rows, has_survival_data, plotly_js_url(), curves)
 
-            kmf = KaplanMeierFitter()
-            kmf.fit(df_patient['duration'], df_patient['event_occurred'])
 
-            # Prepare DataFrame for Plotly
-            km_df = kmf.survival_function_.reset_index()
-            km_df = km_df.rename(columns={
-                'timeline': 'Time (days)',
-                'Overall Survival': 'Survival Probability'
-            })
+def survival(request):
+    try:
+        # Repeat loads are a single cache read until the survival data changes
+        context = get_or_compute('survival_context', _build_survival_context)
+    except Exception as e:
+        return render(request, 'survival_analysis/results.html', {
+            'has_data': False,
+            'message': f'Error generating analysis: {str(e)}'
+        })
 
-            fig_patient = px.line(
-                km_df,
-                x='Time (days)',
-                y='Survival Probability',
-                title='<b>Patient Survival Analysis</b>',
-                labels={'Survival Probability': 'Survival Probability'}
-            )
-            fig_patient.update_layout(
-                hovermode="x unified",
-                plot_bgcolor='white',
-                xaxis=dict(gridcolor='lightgray'),
-                yaxis=dict(gridcolor='lightgray', range=[0, 1])
-            )
-            context['patient_plot'] = fig_patient.to_html(full_html=False)
-
-        # --- 2. SurvivalData Analysis ---
-        if survival_records.exists():
-            df_survival = pd.DataFrame(list(survival_records.values(
-                'days_in_care', 'file_status', 'diagnosis', 'level_of_care'
-            )))
-            df_survival['event'] = df_survival['file_status'].apply(
-                lambda x: 1 if x == 'closed_died' else 0
-            )
+    return render(request, 'survival_analysis/results.html', context)
 
-            # Overall survival curve
-            kmf = KaplanMeierFitter()
-            kmf.fit(df_survival['days_in_care'].dropna(),
-                    df_survival['event'])
 
-            km_df = kmf.survival_function_.reset_index()
-            km_df = km_df.rename(columns={
-                'timeline': 'Time (days)',
-                'KM_estimate': 'Survival Probability'
-            })
+@cache_control(public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+def plotly_js(request, version):
+    """Shared plotly.js bundle for every survival page, cached by the browser"""
+    # Only the current bundle's URL may be cached forever
+    if version != get_plotlyjs_version():
+        raise Http404("Unknown plotly.js version")
+    return HttpResponse(plotly_js_source(), content_type='application/javascript')
 
-            fig_overall = px.line(
-                km_df,
-                x='Time (days)',
-                y='Survival Probability',
-                title='<b>Overall Survival Analysis</b>'
-            )
-            fig_overall.update_layout(
-                hovermode="x unified",
-                plot_bgcolor='white',
-                xaxis=dict(gridcolor='lightgray'),
-                yaxis=dict(gridcolor='lightgray', range=[0, 1])
-            )
+def survival_curve(request, group_by):
+    """JSON Kaplan-Meier curve and Plotly figure for a single group"""
+    value = request.GET.get('value')
+    if group_by not in GROUPINGS or not value:
+        raise Http404("Unknown survival curve")
 
-            # Grouped analysis (by diagnosis)
-            diagnosis_figs = {}
-            for diagnosis in df_survival['diagnosis'].unique():
-                subset = df_survival[df_survival['diagnosis'] == diagnosis]
-                kmf.fit(subset['days_in_care'], subset['event'])
-
-                km_df = kmf.survival_function_.reset_index()
-                km_df = km_df.rename(columns={
-                    'timeline': 'Time (days)',
-                    'KM_estimate': 'Survival Probability'
-                })
-
-                fig = px.line(
-                    km_df,
-                    x='Time (days)',
-                    y='Survival Probability',
-                    title=f'<b>Diagnosis: {diagnosis}</b>'
-                )
-                diagnosis_figs[diagnosis] = fig.to_html(full_html=False)
-
-            context.update({
-                'overall_plot': fig_overall.to_html(full_html=False),
-                'diagnosis_plots': diagnosis_figs,
-                'diagnoses': list(diagnosis_figs.keys())
-            })
+    payload = curve_json(group_by, value)
+    if payload is None:
+        raise Http404("No survival data for this group")
+    return HttpResponse(payload, content_type='application/json')
 
-        return render(request, 'survival_analysis/results.html', context)
-
-    except Exception as e:
-        return render(request, 'survival_analysis/results.html', {
-            'has_data': False,
-            'message': f'Error generating analysis: {str(e)}'
-        })
+def survival_comparison(request, group_by):
+    """JSON log-rank tests between the groups of one grouping"""
+    if group_by not in GROUPINGS:
+        raise Http404("Unknown survival grouping")
+    return JsonResponse(group_comparison(group_by))
 
 def add_survival_data(request):
     if request.method == 'POST':
@@ -140,152 +152,107 @@ def add_survival_data(request):
 
 def import_survival_data(request):
     if request.method == 'POST' and request.FILES.get('survival_file'):
+        if getattr(settings, 'SURVIVAL_IMPORT_BACKGROUND', True):
+            # Hand the file to the import worker pool and return straight away;
+            # the page polls import_job_status until the job finishes.
+            job = SurvivalImportJob.objects.create(file=request.FILES['survival_file'])
+            submit_import_job(job)
+            messages.info(request, f'Import #{job.pk} queued. You can keep working while it runs.')
+            return render(request, 'survival_analysis/import_survival_data.html', {
+                'job': job,
+                'status_url': reverse('import_job_status', args=[job.pk]),
+            })
+
         try:
             file = request.FILES['survival_file']
             df = pd.read_excel(file)
 
-            # Convert date columns if they exist
-            date_columns = ['Dod', 'DateCaseRegistered']
-            for col in date_columns:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-
-            # Process each row
-            success_count = 0
-            for _, row in df.iterrows():
-                try:
-                    patient = PatientDemographics.objects.get(referral_number=row['Ref Number'])
-
-                    # Create or update survival data
-                    SurvivalData.objects.update_or_create(
-                        patient=patient,
-                        defaults={
-                            'diagnosis': row.get('Diagnosis', ''),
-                            'days_in_care': row.get('DaysInCare', None),
-                            'pod': row.get('Pod', '').lower() if pd.notna(row.get('Pod')) else None,
-                            'dod': row.get('Dod', None),
-                            'date_case_registered': row.get('DateCaseRegistered', timezone.now().date()),
-                            'file_status': row.get('FileStatus', 'active').lower().replace(' ', '_'),
-                            'level_of_care': row.get('Levelofcare', '').lower() if pd.notna(
-                                row.get('Levelofcare')) else None,
-                        }
-                    )
-                    success_count += 1
-                except (PatientDemographics.DoesNotExist, KeyError) as e:
-                    continue
-
-            messages.success(request, f'Successfully imported {success_count} records!')
-            return redirect('survival_analysis')
+            report = import_survival_frame(df)
+            imported = report['created'] + report['updated']
+            messages.success(
+                request,
+                f"Successfully imported {imported} records "
+                f"({report['created']} new, {report['updated']} updated)!"
+            )
+            if not report['errors']:
+                return redirect('survival_analysis')
+
+            messages.warning(request, f"{len(report['errors'])} rows could not be imported.")
+            return render(request, 'survival_analysis/import_survival_data.html', {
+                'import_errors': report['errors']
+            })
         except Exception as e:
             messages.error(request, f'Error importing data: {str(e)}')
 
     return render(request, 'survival_analysis/import_survival_data.html')
 
-def predictive_analytics(request):
-    # Get all survival data
-    survival_data = SurvivalData.objects.all()
-
-    # Prepare data for Kaplan-Meier analysis
-    if survival_data.exists():
-        # Convert to DataFrame for analysis
-        data = pd.DataFrame(list(survival_data.values(
-            'id', 'days_in_care', 'file_status', 'diagnosis', 'level_of_care'
-        )))
-
-        # Create event column (1 if died, 0 otherwise)
-        data['event'] = data['file_status'].apply(lambda x: 1 if x == 'closed_died' else 0)
-
-        # Filter out cases with no days_in_care
-        data = data.dropna(subset=['days_in_care'])
-
-        if not data.empty:
-            # Kaplan-Meier analysis
-            kmf = KaplanMeierFitter()
-
-            # Overall survival
-            kmf.fit(data['days_in_care'], data['event'], label='Overall Survival')
-            overall_survival = kmf.survival_function_.reset_index()
-
-            # By diagnosis
-            diagnoses = data['diagnosis'].unique()
-            diagnosis_curves = {}
-            for diagnosis in diagnoses:
-                subset = data[data['diagnosis'] == diagnosis]
-                kmf.fit(subset['days_in_care'], subset['event'], label=diagnosis)
-                diagnosis_curves[diagnosis] = kmf.survival_function_.reset_index()
-
-            # By care level
-            care_levels = data['level_of_care'].dropna().unique()
-            care_level_curves = {}
-            for level in care_levels:
-                subset = data[data['level_of_care'] == level]
-                kmf.fit(subset['days_in_care'], subset['event'], label=level)
-                care_level_curves[level] = kmf.survival_function_.reset_index()
-
-            # Create visualizations
-            overall_fig = px.line(
-                overall_survival,
-                x='timeline',
-                y='KM_estimate',
-                title='Overall Survival Curve',
-                labels={'timeline': 'Days in Care', 'KM_estimate': 'Survival Probability'}
-            )
+def import_job_status(request, job_id):
+    """Progress of a background survival import, polled by the import page"""
+    job = get_object_or_404(SurvivalImportJob, pk=job_id)
+    return JsonResponse({
+        'id': job.pk,
+        'status': job.status,
+        'progress': job.progress,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'created': job.created_count,
+        'updated': job.updated_count,
+        'errors': job.errors[:100],
+        'error_count': job.error_count,
+        'message': job.message,
+        # Lets the page know when the analysis reflects the imported data
+        'data_version': get_data_version(),
+        'analysis_url': reverse('survival_analysis'),
+    })
+
+def _render_overall_graph(curve):
+    """Plot the overall curve as figure JSON for the template (no ORM access)"""
+    return overall_graph_figure(curve).to_json()
+
+
+def _overall_survival_graph():
+    """Plot the overall curve from the incrementally maintained counts"""
+    return _render_overall_graph(read_curve())
 
-            # Convert figures to JSON for template
-            overall_graph = overall_fig.to_json()
 
-            context = {
-                'has_data': True,
-                'overall_graph': overall_graph,
-                'total_cases': len(data),
-                'death_cases': sum(data['event']),
-                'survival_rate': 1 - (sum(data['event']) / len(data)),
-                'diagnoses': diagnoses,
-                'care_levels': care_levels,
-            }
-        else:
-            context = {'has_data': False, 'message': 'No valid survival data available for analysis.'}
+def predictive_analytics(request):
+    # Summary statistics come from a single grouped query in the database
+    summary = survival_summary()
+    overall = summary['overall']
+
+    if overall['total_cases']:
+        context = {
+            'has_data': True,
+            'overall_graph': get_or_compute('predictive_overall_graph', _overall_survival_graph),
+            'total_cases': overall['total_cases'],
+            'death_cases': overall['death_cases'],
+            'survival_rate': overall['survival_rate'],
+            'diagnoses': list(summary['by_diagnosis']),
+            'care_levels': list(summary['by_care_level']),
+            'diagnosis_summary': summary['by_diagnosis'],
+            'care_level_summary': summary['by_care_level'],
+        }
+    elif SurvivalData.objects.exists():
+        context = {'has_data': False, 'message': 'No valid survival data available for analysis.'}
     else:
         context = {'has_data': False, 'message': 'No survival data available.'}
 
     return render(request, 'survival_data/results.html', context)
 
 
-from django.http import HttpResponse
-from openpyxl import Workbook
-
-
 def export_survival_data(request):
-    response = HttpResponse(content_type='application/ms-excel')
-    response['Content-Disposition'] = 'attachment; filename="survival_data.xlsx"'
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Survival Data"
-
-    # Add headers
-    headers = [
-        'Patient ID', 'Patient Name', 'Diagnosis',
-        'Days in Care', 'Place of Death', 'Date of Death',
-        'Status', 'Level of Care'
-    ]
-    ws.append(headers)
-
-    # Add data
-    for data in SurvivalData.objects.all().select_related('patient'):
-        ws.append([
-            data.patient.id,
-            str(data.patient),
-            data.diagnosis,
-            data.days_in_care or '',
-            data.get_pod_display() if data.pod else '',
-            data.dod.strftime('%Y-%m-%d') if data.dod else '',
-            data.get_file_status_display(),
-            data.get_level_of_care_display() if data.level_of_care else ''
-        ])
-
-    wb.save(response)
-    return response
+    """Export all survival data as .xlsx (default) or ?format=csv, streamed in chunks"""
+    if request.GET.get('format') == 'csv':
+        response = StreamingHttpResponse(iter_csv(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="survival_data.csv"'
+        return response
+
+    return FileResponse(
+        write_xlsx(),
+        as_attachment=True,
+        filename='survival_data.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
 
 
 def individual_prediction(request, patient_id):
@@ -300,14 +267,74 @@ def individual_prediction(request, patient_id):
                 'message': 'No survival data available for this patient.'
             })
 
-        # Simple prediction logic (replace with your actual model)
-        risk_score = 0.5  # Placeholder - calculate based on actual data
+        # Scored against the fitted Cox model (manage.py fit_survival_model)
+        model = get_risk_model()
+        if model is None:
+            return render(request, 'survival_analysis/individual.html', {
+                'patient': patient,
+                'survival_data': survival_data,
+                'risk_score': 'Not available',
+                'has_data': True,
+                'message': 'No risk model has been fitted yet.'
+            })
+
+        covariates = PatientSurvival.objects.filter(patient=patient).values(*PatientSurvival.COVARIATES).first()
+        prediction = model.predict(survival_data.diagnosis, survival_data.level_of_care, covariates)
 
         return render(request, 'survival_analysis/individual.html', {
             'patient': patient,
             'survival_data': survival_data,
-            'risk_score': f"{risk_score * 100:.1f}%",
+            'risk_score': f"{prediction['risk'] * 100:.1f}%",
+            'risk_horizon_days': RISK_HORIZONS[0],
+            'risk_horizons': {
+                days: f"{risk * 100:.1f}%" for days, risk in prediction['horizons'].items()
+            },
+            'hazard_ratio': f"{prediction['hazard_ratio']:.2f}",
+            'median_survival': prediction['median_survival'],
+            'model_version': model.version,
             'has_data': True
         })
     except PatientDemographics.DoesNotExist:
-        raise Http404("Patient not found")
\ No newline at end of file
+        raise Http404("Patient not found")
+
+
+RANKING_PAGE_SIZE = 50
+
+
+def risk_ranking(request):
+    """
+    JSON page of active patients ranked by their latest batch risk score.
+    POST queues a rescoring of everyone, for users who may change the scores.
+    """
+    if request.method == 'POST':
+        if not request.user.has_perm('survival_analysis.change_riskscore'):
+            raise PermissionDenied
+        if get_risk_model() is None:
+            return JsonResponse({'queued': False, 'message': 'No risk model has been fitted yet.'}, status=409)
+        if not submit_risk_scoring():
+            return JsonResponse({'queued': False, 'message': 'Rescoring is already running.'}, status=409)
+        return JsonResponse({
+            'queued': True, 'message': 'Rescoring queued. The ranking updates when it finishes.'
+        }, status=202)
+
+    scores = RiskScore.objects.select_related('patient', 'survival_data').order_by('-risk', 'pk')
+    page = Paginator(scores, RANKING_PAGE_SIZE).get_page(request.GET.get('page'))
+    latest = page.object_list[0] if page.object_list else None
+    return JsonResponse({
+        'page': page.number,
+        'num_pages': page.paginator.num_pages,
+        'risk_horizon_days': RISK_HORIZONS[0],
+        'scored_at': latest.scored_at if latest else None,
+        'model_version': latest.model_id if latest else None,
+        'patients': [
+            {
+                'patient_id': score.patient_id,
+                'patient': str(score.patient),
+                'survival_data_id': score.survival_data_id,
+                'diagnosis': score.survival_data.diagnosis,
+                'risk': score.risk,
+                'hazard_ratio': score.hazard_ratio,
+            }
+            for score in page
+        ],
+    })